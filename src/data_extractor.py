@@ -1,115 +1,317 @@
-from data_reader import extract_COVID_data
+from data_reader import extract_COVID_data, load_COVID_sources, COVID_FILES
+import hashlib
 import json
+import os
 import os.path as path
+import tempfile
+import numpy as np
+from collections import OrderedDict
 from datetime import datetime
 
-'''This module calls the data extraction and uses the SIRVD model to extract the variable parameters for the simulation.'''
+PARAMETER_CACHE_DIRECTORY = './Data/cache/parameters'
+PARAMETER_CACHE_VERSION = 1
+PARAMETER_SET_CACHE_SIZE = 32
+
+# Resident population used to turn the per-contact infection rate into a per-person one
+COUNTRY_POPULATION = {
+    'Italy': 60000000,
+    'France': 67390000,
+    'Germany': 83240000,
+    'Spain': 47350000,
+    'United Kingdom': 67220000,
+    'United States': 331000000,
+    'Canada': 38010000,
+    'Japan': 125800000,
+    'Brazil': 212600000,
+    'India': 1380000000
+}
+
+'''This module calls the data extraction and uses the SIRVD model to extract the variable parameters for the simulation.
+   The SIRVD recurrence is inverted for a whole batch of countries and recovery/breakthrough assumptions at once, with
+   one row per (country, assumption) pair, and every result is cached under a key made of the country, the assumptions
+   and the hashes of the source data, so that a change to any of them can never return stale parameters. Extracted
+   sets are also kept in memory, indexed by date, so that time windows of the same set are served as array views.'''
 def get_country_population(country):
+    return COUNTRY_POPULATION.get(country, -1)
+
+
+def invert_SIRVD(V, D, I_new, N, initial_infected, average_recovery_time, average_breakthrough_time):
+
+    # V, D and I_new are (batch, days) arrays starting the day after the first reported case; N, initial_infected and
+    # the assumptions have one value per row. The arithmetic follows the single-country recurrence step by step.
+    batch, days = V.shape
+    S = np.zeros((batch, days))
+    I = np.zeros((batch, days))
+    R = np.zeros((batch, days))
+    S[:, 0] = N - initial_infected
+    I[:, 0] = initial_infected
+
+    mu = 1. / np.asarray(average_recovery_time, dtype=float)
+    breakthrough_time = np.asarray(average_breakthrough_time, dtype=float)
+    sigma = np.where(breakthrough_time != -1, 1. / np.where(breakthrough_time != -1, breakthrough_time, 1.), 0.)
+
+    parameters = {name: np.zeros((batch, max(days - 1, 0))) for name in ('alpha', 'psi', 'nu', 'mu', 'sigma')}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for t in range(days - 1):
+            D_dot = D[:, t+1] - D[:, t]
+            V_dot = V[:, t+1] - V[:, t]
+
+            S_t = S[:, t]
+            I_t = I[:, t]
+            R_t = R[:, t]
+            I_new_t = I_new[:, t+1]
+
+            psi_t = np.where(D_dot != 0, D_dot / I_t, 0.)
+            nu_t = V_dot / S_t
+            alpha_t = np.where(I_new_t != 0, I_new_t / (S_t * I_t), 0.)
+
+            S[:, t+1] = S_t - I_new_t - V_dot + sigma * R_t
+            I[:, t+1] = I_t + I_new_t - mu*I_t - psi_t * I_t
+            R[:, t+1] = mu*I_t + R_t - sigma * R_t
+
+            parameters['alpha'][:, t] = alpha_t
+            parameters['psi'][:, t] = psi_t
+            parameters['nu'][:, t] = nu_t
+            parameters['mu'][:, t] = mu
+            parameters['sigma'][:, t] = sigma
+
+    return S, I, R, parameters
+
+
+class BatchDataExtractor:
+    def __init__(self, countries: list, assumptions: list, cache_directory: str = PARAMETER_CACHE_DIRECTORY):
+
+        # assumptions is a list of (average_recovery_time, average_breakthrough_time) pairs, applied to every country
+        self.countries = list(countries)
+        self.assumptions = [tuple(assumption) for assumption in assumptions]
+        self.cache_directory = cache_directory
+
+        for country in self.countries:
+            if get_country_population(country) == -1:
+                print(f"Error: population of {country} not available")
+                exit()
+
+
+    def __key(self, country, assumption, source_hash):
+
+        description = json.dumps([PARAMETER_CACHE_VERSION, country, get_country_population(country),
+                                  list(assumption), source_hash])
+        return hashlib.sha256(description.encode()).hexdigest()
+
+
+    # Returns a dictionary from (country, average_recovery_time, average_breakthrough_time) to the extracted data
+    def get_params(self):
+
+        sources = load_COVID_sources()
+        source_hash = [sources[key]['Hash'] for key in COVID_FILES]
+
+        results = dict()
+        missing = list()
+        for country in self.countries:
+            for assumption in self.assumptions:
+                key = self.__key(country, assumption, source_hash)
+                cached = self.__load(key)
+                if cached is None:
+                    missing.append((country, assumption, key))
+                else:
+                    results[(country,) + assumption] = cached
+
+        if missing:
+            print(f"Extracting COVID parameters for {len(missing)} country and assumption pairs")
+            for (country, assumption, key), data in zip(missing, self.__extract(missing, sources)):
+                self.__save(key, data)
+                results[(country,) + assumption] = data
+
+        return results
+
+
+    def __extract(self, batch, sources):
+
+        # Each country is aligned once, then its series are repeated for every assumption of the batch
+        series = dict()
+        for country, _, _ in batch:
+            if country not in series:
+                COVID_data = extract_COVID_data(country, sources)
+
+                I_new = np.asarray(COVID_data['I_new'])
+                start_covid = int(np.argmax(I_new >= 1))
+                if I_new[start_covid] < 1:
+                    print(f"Error: no reported infections for {country}")
+                    exit()
+
+                series[country] = {'Time': np.array(COVID_data['Time'][start_covid+1:], dtype='datetime64[D]'),
+                                   'V': np.asarray(COVID_data['V'][start_covid+1:]),
+                                   'D': np.asarray(COVID_data['D'][start_covid+1:]),
+                                   'I_new': I_new[start_covid+1:],
+                                   'initial_infected': I_new[start_covid]}
+
+        # Rows of different length are padded at the end; the padding never feeds back into the real days
+        days = max(len(series[country]['Time']) for country, _, _ in batch)
+        inputs = {name: np.zeros((len(batch), days)) for name in ('V', 'D', 'I_new')}
+        for row, (country, _, _) in enumerate(batch):
+            length = len(series[country]['Time'])
+            for name in inputs:
+                inputs[name][row, :length] = series[country][name]
+
+        S, I, R, parameters = invert_SIRVD(inputs['V'], inputs['D'], inputs['I_new'],
+                                           np.array([get_country_population(country) for country, _, _ in batch]),
+                                           np.array([series[country]['initial_infected'] for country, _, _ in batch]),
+                                           [assumption[0] for _, assumption, _ in batch],
+                                           [assumption[1] for _, assumption, _ in batch])
+
+        for row, (country, _, _) in enumerate(batch):
+            length = len(series[country]['Time'])
+            N = get_country_population(country)
+            yield {'S': S[row, :length], 'I': I[row, :length], 'R': R[row, :length],
+                   'V': series[country]['V'], 'D': series[country]['D'],
+                   'InfectionRate': parameters['alpha'][row, :length-1] * N, 'FatalityRate': parameters['psi'][row, :length-1],
+                   'VaccinationRate': parameters['nu'][row, :length-1], 'RecoveryRate': parameters['mu'][row, :length-1],
+                   'BreakthroughRate': parameters['sigma'][row, :length-1], 'Time': series[country]['Time']}
+
+
+    def __load(self, key):
+
+        filename = path.join(self.cache_directory, key + '.npz')
+        if not path.exists(filename):
+            return None
+        with np.load(filename) as data:
+            return {name: data[name] for name in data.files}
+
+
+    def __save(self, key, data):
+
+        # Written aside and renamed, so a concurrent reader never loads a partial file
+        os.makedirs(self.cache_directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.cache_directory, suffix='.npz')
+        with os.fdopen(descriptor, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(temporary, path.join(self.cache_directory, key + '.npz'))
+
+
+class ParameterSet:
+    def __init__(self, data: dict):
+
+        # Dates are the sorted index of the set; every other entry is a read-only array sliced on that index
+        self.Time = np.asarray(data['Time'], dtype='datetime64[D]')
+        if np.any(self.Time[1:] < self.Time[:-1]):
+            print("Error: dates of the extracted parameters are not sorted")
+            exit()
+
+        self.columns = dict()
+        for key, values in data.items():
+            if key != 'Time':
+                self.columns[key] = np.array(values, dtype=np.float64)
+                self.columns[key].setflags(write=False)
+        self.Time.setflags(write=False)
+
+
+    # Entries from init_time to end_time, both included; -1 leaves that side of the window open. The rates of a day
+    # lead to the next one, so the last extracted day has none: windows stop at the last day with rates, and every
+    # returned entry has the same length
+    def window(self, init_time = -1, end_time = -1):
+
+        days = min(len(values) for values in self.columns.values())
+        t_start = 0 if init_time == -1 else int(np.searchsorted(self.Time, np.datetime64(init_time), side='left'))
+        t_end = days if end_time == -1 else int(np.searchsorted(self.Time, np.datetime64(end_time), side='right'))
+        t_end = min(t_end, days)
+
+        out_data = {key: values[t_start:t_end] for key, values in self.columns.items()}
+        out_data['Time'] = self.Time[t_start:t_end]
+
+        return out_data
+
+
+_parameter_sets = OrderedDict()
+
+# Least recently used parameter sets are dropped once the in-process cache holds more than PARAMETER_SET_CACHE_SIZE
+def _get_parameter_set(key, load):
+
+    if key in _parameter_sets:
+        _parameter_sets.move_to_end(key)
+        return _parameter_sets[key], False
+
+    parameter_set = ParameterSet(load())
+    _parameter_sets[key] = parameter_set
+    if len(_parameter_sets) > PARAMETER_SET_CACHE_SIZE:
+        _parameter_sets.popitem(last=False)
+    return parameter_set, True
+
+
+# Modification time and size of each file, or None if one of them is missing
+def _file_signatures(files):
+
+    try:
+        return tuple((status.st_mtime_ns, status.st_size) for status in map(os.stat, files))
+    except FileNotFoundError:
+        return None
 
-    if country == 'Italy':
-        return 60000000
-    else:
-        return -1
 
 class DataExtractor:
 
-    #TODO
     def __init__(self, country, average_recovery_time, average_breakthrough_time):
 
         self.COVID_country = country
         self.average_recovery_time = average_recovery_time
         self.average_breakthrough_time = average_breakthrough_time
-        
+
         self.N = get_country_population(country)
-        
-        self.I = list()
-        self.S = list()
-        self.R = list()
-        self.alpha = list()
-        self.mu = list()
-        self.psi = list()
-        self.nu = list()
-        self.sigma = list()
 
 
     def get_params(self, init_time = -1, end_time = -1, result_file = "extracted_data.json"):
-        
-        SIRVD_data = dict()
-        if not path.exists(result_file):
-            print("Extracting COVID parameters")
-            self.__run_simulation()
-
-            SIRVD_data = {'S': self.S, 'I': self.I, 'R': self.R, 'V': self.V, 'D': self.D,
-                      'InfectionRate' : [alpha * self.N for alpha in self.alpha], 'FatalityRate': self.psi, 
-                      'VaccinationRate': self.nu, 'RecoveryRate': self.mu, 'BreakthroughRate': self.sigma, 
-                      'Time': self.Time}
-            
-            self.__save_data_to_json(SIRVD_data, result_file)
-        else:
-            SIRVD_data = self.__load_data_from_json(result_file)
-
-        t_start = 0
-        t_end = len(SIRVD_data['Time']) - 1
 
-        if init_time != -1:
-            while init_time > SIRVD_data['Time'][t_start]:
-                t_start += 1
-        if end_time != -1:
-            while end_time > SIRVD_data['Time'][t_end]:
-                t_end -=1
-
-        out_data = {key : values_list[t_start:t_end] for key, values_list in SIRVD_data.items()}
-
-        return out_data
-    
-
-    def __run_simulation(self):
-
-        COVID_data = extract_COVID_data(self.COVID_country)
+        # Loaded sets stay in memory while their files are unchanged, so a new window is only a binary search on the
+        # dates and the returned arrays are views on the cached set. result_file is an export of the extraction, read
+        # back only when the source data needed to check it is not available, and only for the country and
+        # assumptions it was extracted with
+        sources = _file_signatures(COVID_FILES.values())
+        if sources is None and result_file and path.exists(result_file):
+            key = ('json', path.abspath(result_file), _file_signatures([result_file]), self.COVID_country,
+                   self.average_recovery_time, self.average_breakthrough_time)
+            parameter_set, loaded = _get_parameter_set(key, lambda: self.__load_data_from_json(result_file))
+            if loaded:
+                print(f"Warning: COVID source data not found, using {result_file} as is")
+        else:
+            key = (self.COVID_country, self.average_recovery_time, self.average_breakthrough_time, sources)
+            parameter_set, loaded = _get_parameter_set(key, self.__extract)
+            if result_file and (loaded or not path.exists(result_file)):
+                self.__save_data_to_json(parameter_set, result_file)
 
-        start_covid = 0
-        while COVID_data['I_new'][start_covid] < 1:
-            start_covid += 1
+        return parameter_set.window(init_time, end_time)
 
-        self.Time = COVID_data['Time'][start_covid+1:]
-        self.V = COVID_data['V'][start_covid+1:]
-        self.D = COVID_data['D'][start_covid+1:]
-        self.I_new = COVID_data['I_new'][start_covid+1:]
 
-        initial_infected = COVID_data['I_new'][start_covid]
+    def __extract(self):
 
-        self.S.append(self.N - initial_infected)
-        self.R.append(0)
-        self.I.append(initial_infected)
+        extractor = BatchDataExtractor([self.COVID_country], [(self.average_recovery_time, self.average_breakthrough_time)])
+        return next(iter(extractor.get_params().values()))
 
-        t = 0
-        while (t < len(self.Time)-1):
-            self.__extract_SIRVD_param(t)
-            t += 1
 
+    def __save_data_to_json(self, parameter_set, filename):
 
-    
-    def __save_data_to_json(self, extracted_data, filename):
-        
         if not filename.endswith('.json'):
             print(f"Error: format of file {filename} not supported (only JSON is valid)")
             return
 
         data_to_save = {
+            'extraction': {
+                'country': self.COVID_country,
+                'average_recovery_time': self.average_recovery_time,
+                'average_breakthrough_time': self.average_breakthrough_time
+            },
             'observables': {
-                'Time': [datetime.strftime(date_time, "%Y/%m/%d") for date_time in extracted_data['Time']],
-                'S': extracted_data['S'],
-                'I': extracted_data['I'],
-                'R': extracted_data['R'],
-                'V': extracted_data['V'],
-                'D': extracted_data['D']
+                'Time': [date.strftime("%Y/%m/%d") for date in parameter_set.Time.astype(datetime)],
+                'S': parameter_set.columns['S'].tolist(),
+                'I': parameter_set.columns['I'].tolist(),
+                'R': parameter_set.columns['R'].tolist(),
+                'V': parameter_set.columns['V'].tolist(),
+                'D': parameter_set.columns['D'].tolist()
             },
             'parameters': {
-                'InfectionRate': extracted_data['InfectionRate'],
-                'FatalityRate': extracted_data['FatalityRate'],
-                'VaccinationRate': extracted_data['VaccinationRate'],
-                'RecoveryRate': extracted_data['RecoveryRate'],
-                'BreakthroughRate': extracted_data['BreakthroughRate'],
+                'InfectionRate': parameter_set.columns['InfectionRate'].tolist(),
+                'FatalityRate': parameter_set.columns['FatalityRate'].tolist(),
+                'VaccinationRate': parameter_set.columns['VaccinationRate'].tolist(),
+                'RecoveryRate': parameter_set.columns['RecoveryRate'].tolist(),
+                'BreakthroughRate': parameter_set.columns['BreakthroughRate'].tolist(),
             }
         }
 
@@ -120,7 +322,7 @@ class DataExtractor:
 
 
     def __load_data_from_json(self, filename):
-        
+
         data = dict()
         with open(filename, 'r') as f:
             data_file = json.load(f)
@@ -130,38 +332,31 @@ class DataExtractor:
                     data[key] = [datetime.strptime(time_data, "%Y/%m/%d") for time_data in data_file['observables']['Time']]
                 else:
                     data[key] = data_file['observables'][key]
-            
+
             data.update(data_file['parameters'])
 
+        self.__check_extraction(filename, data_file.get('extraction'), data)
         return data
-    
-
-    def __extract_SIRVD_param(self, t):
-        N = self.N
-
-        D_dot = self.D[t+1] - self.D[t]
-        V_dot = self.V[t+1] - self.V[t]
-
-        S_t = self.S[t]
-        I_t = self.I[t]
-        R_t = self.R[t]
-        I_new = self.I_new[t+1]
-
-        psi_t = D_dot / I_t if D_dot != 0 else 0
-        nu_t = V_dot / S_t
-        mu_t = 1. / self.average_recovery_time
-        alpha_t = I_new / (S_t * I_t) if I_new != 0 else 0
-        sigma_t = 1. / self.average_breakthrough_time if self.average_breakthrough_time != -1 else 0
-
-        S_t_future = S_t - I_new - V_dot + sigma_t * R_t
-        I_t_future = I_t + I_new - mu_t*I_t - psi_t * I_t
-        R_t_future = mu_t*I_t + R_t - sigma_t * R_t
-
-        self.psi.append(psi_t)
-        self.mu.append(mu_t)
-        self.sigma.append(sigma_t)
-        self.nu.append(nu_t)
-        self.alpha.append(alpha_t)
-        self.S.append(S_t_future)
-        self.R.append(R_t_future)
-        self.I.append(I_t_future)
+
+
+    def __check_extraction(self, filename, extraction, data):
+
+        expected = {'country': self.COVID_country, 'average_recovery_time': self.average_recovery_time,
+                    'average_breakthrough_time': self.average_breakthrough_time}
+
+        if extraction is not None:
+            mismatches = [f"{name} {extraction.get(name)} instead of {value}" for name, value in expected.items()
+                          if extraction.get(name) != value]
+            if mismatches:
+                print(f"Error: {filename} was extracted with {', '.join(mismatches)}; remove it or use another file")
+                exit()
+            return
+
+        # Older exports do not record how they were extracted: the assumptions are still the constant recovery and
+        # breakthrough rates, while the country cannot be checked
+        recovery_rate = 1. / self.average_recovery_time
+        breakthrough_rate = 1. / self.average_breakthrough_time if self.average_breakthrough_time != -1 else 0.
+        if not (np.allclose(data['RecoveryRate'], recovery_rate) and np.allclose(data['BreakthroughRate'], breakthrough_rate)):
+            print(f"Error: {filename} was extracted with other recovery and breakthrough times; remove it or use another file")
+            exit()
+        print(f"Warning: {filename} does not record its country, it is assumed to hold the data of {self.COVID_country}")
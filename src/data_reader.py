@@ -1,90 +1,173 @@
 import csv
-from datetime import datetime, timedelta
-
-'''This module defines the functionalities to extract COVID data given a certain country.'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from datetime import datetime
+
+CACHE_DIRECTORY = './Data/cache'
+COVID_FILES = {'D': './Data/deaths.csv', 'V': './Data/vaccinated.csv', 'I_new': './Data/infected_cases.csv'}
+
+'''This module defines the functionalities to extract COVID data given a certain country. Files are read into NumPy
+   columns with the dates parsed in bulk and the rows grouped by country, so that every country is a contiguous slice,
+   and the series are aligned on the daily time grid through array indexing. Parsed files are kept in a columnar cache
+   of memory-mapped arrays, rebuilt when the modification time and the hash of the source file say it has changed.'''
 def read_data_from_file(path_to_file: str):
 
-    data = {'Country': [], 'Day': [], 'Data': []}
-    with open(path_to_file) as file:
-        row_iterator = csv.DictReader(file, delimiter=',')
+    with open(path_to_file, newline='') as file:
+        row_iterator = csv.reader(file, delimiter=',')
+        header = next(row_iterator)
+        columns = list(zip(*row_iterator))
+
+    if len(columns) == 0:
+        columns = [()] * len(header)
+    columns = dict(zip(header, columns))
+
+    # Rows of the same country are grouped with a stable sort, so each country keeps the order of the file
+    countries, country_codes = np.unique(np.array(columns['Entity'], dtype=str), return_inverse=True)
+    order = np.argsort(country_codes, kind='stable')
+    bounds = np.searchsorted(country_codes[order], np.arange(len(countries) + 1))
+
+    return {
+        'Day': np.array(columns['Day'], dtype='datetime64[D]')[order],
+        'Data': np.array(columns['Data'], dtype=str).astype(np.float64)[order],
+        'Rows': {country: slice(int(bounds[i]), int(bounds[i + 1])) for i, country in enumerate(countries.tolist())}
+    }
+
+
+def _file_hash(path_to_file: str):
+
+    digest = hashlib.sha256()
+    with open(path_to_file, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_data(path_to_file: str, cache_directory: str = CACHE_DIRECTORY):
+
+    # Same content as read_data_from_file, served from the cache; the hash is only computed when the modification
+    # time or the size of the source differ from the cached ones
+    cache_path = os.path.join(cache_directory, os.path.basename(path_to_file))
+    source_path = os.path.join(cache_path, 'source.json')
+    status = os.stat(path_to_file)
+
+    if os.path.isfile(source_path):
+        with open(source_path, 'r') as f:
+            source = json.load(f)
+
+        valid = source['mtime'] == status.st_mtime_ns and source['size'] == status.st_size
+        if not valid and source['sha256'] == _file_hash(path_to_file):
+            source.update({'mtime': status.st_mtime_ns, 'size': status.st_size})
+            with open(source_path, 'w') as f:
+                json.dump(source, f)
+            valid = True
+
+        if valid:
+            with open(os.path.join(cache_path, 'countries.json'), 'r') as f:
+                rows = {country: slice(start, stop) for country, (start, stop) in json.load(f).items()}
+            return {'Day': np.load(os.path.join(cache_path, 'Day.npy'), mmap_mode='r'),
+                    'Data': np.load(os.path.join(cache_path, 'Data.npy'), mmap_mode='r'),
+                    'Rows': rows, 'Hash': source['sha256']}
+
+    data = read_data_from_file(path_to_file)
+    data['Hash'] = _file_hash(path_to_file)
+    _save_to_cache(data, cache_path, {'mtime': status.st_mtime_ns, 'size': status.st_size, 'sha256': data['Hash']})
+    return data
 
-        for row in row_iterator:
-            data['Country'].append(row['Entity'])
-            data['Day'].append(datetime.strptime(row['Day'], "%Y-%m-%d"))
-            data['Data'].append(float(row['Data']))
 
-    return data
+def _save_to_cache(data: dict, cache_path: str, source: dict):
 
-def filter_from_country(data: dict, country: str):
+    # The entry is written aside and moved into place, so a reader never finds it half written
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=os.path.dirname(cache_path) or '.')
+    np.save(os.path.join(temporary, 'Day.npy'), data['Day'])
+    np.save(os.path.join(temporary, 'Data.npy'), data['Data'])
+    with open(os.path.join(temporary, 'countries.json'), 'w') as f:
+        json.dump({country: [rows.start, rows.stop] for country, rows in data['Rows'].items()}, f)
+    with open(os.path.join(temporary, 'source.json'), 'w') as f:
+        json.dump(source, f)
 
-    country_set = set(data['Country'])
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(temporary, cache_path)
 
-    if country not in country_set:
+def filter_from_country(data: dict, country: str):
+
+    if country not in data['Rows']:
         print('Error: country not present in data')
         return dict()
 
-    out_data = {'Day': [], 'Data': []}    
-    for i in range(len(data['Country'])):
-        if data['Country'][i] == country:
-            out_data['Day'].append(data['Day'][i])
-            out_data['Data'].append(data['Data'][i])
+    rows = data['Rows'][country]
+    return {'Day': data['Day'][rows], 'Data': data['Data'][rows]}
+
 
-    return out_data
+def _to_datetime64(time):
+    return np.datetime64(time, 'us') if isinstance(time, datetime) else np.datetime64(time).astype('datetime64[us]')
 
 
 def align_time_data(list_of_data: dict, start_time = None, end_time = None):
 
+    day = np.timedelta64(1, 'D')
+
     if start_time == None:
-        min_time = min([data['Day'][0] for data in list_of_data.values()])
+        min_time = min([data['Day'][0] for data in list_of_data.values()]).astype('datetime64[us]')
     else:
-        min_time = start_time
+        min_time = _to_datetime64(start_time)
 
     if end_time == None:
-        max_time = min([data['Day'][-1] for data in list_of_data.values()])
-        max_time -= timedelta(1)
+        max_time = min([data['Day'][-1] for data in list_of_data.values()]).astype('datetime64[us]') - day
     else:
-        max_time = end_time
+        max_time = _to_datetime64(end_time)
 
-    new_data = {'Time': []}
-    current_time = min_time
-    while current_time <= max_time:
-        new_data['Time'].append(current_time)
-        current_time += timedelta(days=1)
+    steps = max(0, (max_time - min_time) // day + 1)
+    time_grid = min_time + np.arange(steps) * day
+    new_data = {'Time': time_grid.astype(datetime).tolist()}
 
     for key in list_of_data:
 
-        new_data[key] = list()
-        current_time = min_time
-        current_start_time = list_of_data[key]['Day'][0]
-
-        while current_time < current_start_time:
-            new_data[key].append(0.0)
-            current_time += timedelta(days=1)
-
-        i = 0
-        while current_time <= max_time:
-            if current_time in list_of_data[key]['Day']:
-                if key == 'D' and len(new_data[key]) != 0:
-                    new_data[key].append(list_of_data[key]['Data'][i] + new_data[key][-1])
-                else:
-                    new_data[key].append(list_of_data[key]['Data'][i])
-                i += 1
-            else:
-                new_data[key].append(new_data[key][-1])
-            current_time += timedelta(days=1)
+        days = list_of_data[key]['Day'].astype('datetime64[us]')
+        values = list_of_data[key]['Data']
+
+        # Days before the first report of the series are zero; from there on the k-th grid day found in the series
+        # takes the k-th reported value and days without a report repeat the previous value
+        padding = max(0, -((min_time - days[0]) // day))
+        start = min_time + padding * day
+        loop_steps = max(0, (max_time - start) // day + 1)
+        loop_grid = start + np.arange(loop_steps) * day
+
+        reported = np.isin(loop_grid, days)
+        value_index = np.cumsum(reported) - 1
+        if loop_steps > 0 and value_index[0] < 0 and padding == 0:
+            print(f'Error: no data for {key} at the start of the time range')
+            exit()
+
+        values = values[:np.count_nonzero(reported)]
+        if key == 'D':
+            values = np.cumsum(values)
+
+        # A leading zero stands for the days before the first value, which follow the zero padding
+        aligned = np.zeros(padding + loop_steps)
+        aligned[padding:] = np.concatenate(([0.0], values))[value_index + 1]
+        new_data[key] = aligned.tolist()
 
     return new_data
 
 
-def extract_COVID_data(country: str):
+def load_COVID_sources():
+    return {key: load_data(path_to_file) for key, path_to_file in COVID_FILES.items()}
+
+
+def extract_COVID_data(country: str, sources: dict = None):
 
-    deaths = read_data_from_file('./Data/deaths.csv')
-    vaccinated = read_data_from_file('./Data/vaccinated.csv')
-    infected = read_data_from_file('./Data/infected_cases.csv')
+    # Sources loaded once with load_COVID_sources can be shared by the extraction of many countries
+    if sources is None:
+        sources = load_COVID_sources()
 
-    deaths_country = filter_from_country(deaths, country)
-    vaccinated_country = filter_from_country(vaccinated, country)
-    infected_country = filter_from_country(infected, country)
+    deaths_country = filter_from_country(sources['D'], country)
+    vaccinated_country = filter_from_country(sources['V'], country)
+    infected_country = filter_from_country(sources['I_new'], country)
 
     data = {'D': deaths_country, 'V': vaccinated_country, 'I_new': infected_country}
 
@@ -0,0 +1,104 @@
+'''This module implements an indexed binary min-heap of (time, key) pairs, where every key appears at most once and its
+   time can be changed or removed in logarithmic time.'''
+class IndexedPriorityQueue:
+    def __init__(self):
+        self.keys = list()
+        self.times = list()
+        self.position = dict()
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def __contains__(self, key):
+        return key in self.position
+
+
+    def peek(self):
+        return self.times[0], self.keys[0]
+
+
+    def push(self, key, time):
+
+        if key in self.position:
+            index = self.position[key]
+            old_time = self.times[index]
+            self.times[index] = time
+            if time < old_time:
+                self.__sift_up(index)
+            else:
+                self.__sift_down(index)
+            return
+
+        self.keys.append(key)
+        self.times.append(time)
+        self.position[key] = len(self.keys) - 1
+        self.__sift_up(len(self.keys) - 1)
+
+
+    def pop(self):
+
+        time, key = self.times[0], self.keys[0]
+        self.__remove_at(0)
+        return time, key
+
+
+    def remove(self, key):
+
+        index = self.position.get(key)
+        if index is not None:
+            self.__remove_at(index)
+
+
+    def __remove_at(self, index):
+
+        last = len(self.keys) - 1
+        del self.position[self.keys[index]]
+
+        if index != last:
+            self.keys[index] = self.keys[last]
+            self.times[index] = self.times[last]
+            self.position[self.keys[index]] = index
+
+        self.keys.pop()
+        self.times.pop()
+
+        if index < len(self.keys):
+            self.__sift_up(index)
+            self.__sift_down(index)
+
+
+    def __swap(self, i, j):
+
+        self.keys[i], self.keys[j] = self.keys[j], self.keys[i]
+        self.times[i], self.times[j] = self.times[j], self.times[i]
+        self.position[self.keys[i]] = i
+        self.position[self.keys[j]] = j
+
+
+    def __sift_up(self, index):
+
+        while index > 0:
+            parent = (index - 1) // 2
+            if self.times[index] >= self.times[parent]:
+                break
+            self.__swap(index, parent)
+            index = parent
+
+
+    def __sift_down(self, index):
+
+        size = len(self.keys)
+        while True:
+            smallest = index
+            left = 2 * index + 1
+            right = left + 1
+            if left < size and self.times[left] < self.times[smallest]:
+                smallest = left
+            if right < size and self.times[right] < self.times[smallest]:
+                smallest = right
+            if smallest == index:
+                break
+            self.__swap(index, smallest)
+            index = smallest
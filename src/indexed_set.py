@@ -0,0 +1,51 @@
+import random
+
+'''This module implements a set that also keeps its items in a list, so that items can be added, removed (by swapping
+   with the last one) and accessed by position or at random in constant time.'''
+class IndexedSet:
+    def __init__(self, items=()):
+        self.items = list()
+        self.position = dict()
+
+        for item in items:
+            self.add(item)
+
+
+    def __len__(self):
+        return len(self.items)
+
+
+    def __contains__(self, item):
+        return item in self.position
+
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+
+    def add(self, item):
+
+        if item in self.position:
+            return
+        self.position[item] = len(self.items)
+        self.items.append(item)
+
+
+    def discard(self, item):
+
+        index = self.position.pop(item, None)
+        if index is None:
+            return
+
+        last = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last
+            self.position[last] = index
+
+
+    def choice(self, rng=random):
+        return self.items[rng.randrange(len(self.items))]
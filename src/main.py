@@ -1,8 +1,12 @@
 from sirvd_network_constant_parameters import SIRVD_NetworkConstantParameters
 from sirvd_network_variable_parameters import SIRVD_NetworkVariableParameters
 from sirvd_compartmental_model import SIRVD_CompartmentalModel
-from data_extractor import DataExtractor
+from sirvd_pair_approximation import SIRVD_PairApproximationModel
+from data_extractor import DataExtractor, get_country_population
 from sirvd_plotter import SIRVD_Plotter
+from sirvd_ensemble import run_ensemble
+from sirvd_sweep import run_sweep
+from sirvd_calibration import calibrate
 from datetime import datetime
 
 POPULATION = 2000
@@ -10,13 +14,13 @@ POPULATION = 2000
 
 def run_constant_network_model(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate, 
                                breakthrough_rate, recovery_rate, simulation_time, delta_days, initial_infected,
-                               result_file = 'SIRVD_network_constant.json', is_dynamic = False, lockdowns = None, events = None,
-                               target_higher = False, target_lower = False):
+                               result_file = 'SIRVD_network_constant.sirvd', is_dynamic = False, lockdowns = None, events = None,
+                               target_higher = False, target_lower = False, engine = 'agent'):
     
     sirvd_model = SIRVD_NetworkConstantParameters(N=POPULATION, infection_rate=infection_rate, recovery_rate=recovery_rate, 
                                                   fatality_rate=fatality_rate, vaccination_rate=vaccination_rate, 
                                                   breakthrough_rate=breakthrough_rate, graph_type=graph_type, graph_params=graph_parameters,
-                                                  delta_t=delta_days, is_dynamic=is_dynamic)
+                                                  delta_t=delta_days, is_dynamic=is_dynamic, engine=engine)
     
     sirvd_model.run_simulation(initial_infectious=initial_infected, simulation_time=simulation_time,
                                result_filename=result_file, lockdowns=lockdowns, events=events, target_higher=target_higher, target_lower=target_lower)
@@ -24,11 +28,11 @@ def run_constant_network_model(graph_type, graph_parameters, infection_rate, vac
 
 def run_dynamic_network_model(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate, breakthrough_rate,
                               recovery_rate, simulation_time, delta_days, initial_infected, 
-                              result_file = 'SIRVD_network_variable.json', is_dynamic = False, lockdowns = None, events = None,
-                              target_higher = False, target_lower = False):
+                              result_file = 'SIRVD_network_variable.sirvd', is_dynamic = False, lockdowns = None, events = None,
+                              target_higher = False, target_lower = False, engine = 'agent'):
     
     sirvd_model = SIRVD_NetworkVariableParameters(N=POPULATION, graph_type=graph_type, graph_params=graph_parameters,
-                                                  delta_t=delta_days, is_dynamic=is_dynamic, infection_rate_schedule=infection_rate,
+                                                  delta_t=delta_days, is_dynamic=is_dynamic, engine=engine, infection_rate_schedule=infection_rate,
                                                   recovery_rate_schedule=recovery_rate, fatality_rate_schedule=fatality_rate,
                                                   vaccination_rate_schedule=vaccination_rate, breakthrough_rate_schedule=breakthrough_rate)
     
@@ -36,8 +40,40 @@ def run_dynamic_network_model(graph_type, graph_parameters, infection_rate, vacc
                                result_filename=result_file, lockdowns=lockdowns, events=events, target_higher=target_higher, target_lower=target_lower)
     
 
+def run_constant_network_ensemble(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
+                                  breakthrough_rate, recovery_rate, simulation_time, delta_days, initial_infected, replicates,
+                                  result_file = 'SIRVD_network_ensemble.json', is_dynamic = False, lockdowns = None, events = None,
+                                  target_higher = False, target_lower = False, engine = 'agent', seed = None, workers = None,
+                                  share_graph = False, graph_cache = None):
+
+    model_params = {'N': POPULATION, 'infection_rate': infection_rate, 'recovery_rate': recovery_rate,
+                    'fatality_rate': fatality_rate, 'vaccination_rate': vaccination_rate, 'breakthrough_rate': breakthrough_rate,
+                    'graph_type': graph_type, 'graph_params': graph_parameters, 'delta_t': delta_days, 'is_dynamic': is_dynamic,
+                    'engine': engine, 'graph_cache': graph_cache}
+
+    run_ensemble(SIRVD_NetworkConstantParameters, model_params, replicates, initial_infected, simulation_time, result_file,
+                 seed=seed, workers=workers, share_graph=share_graph, lockdowns=lockdowns, events=events, target_higher=target_higher, target_lower=target_lower)
+
+
+def run_constant_network_sweep(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
+                               breakthrough_rate, recovery_rate, simulation_time, delta_days, initial_infected, grid,
+                               result_directory = 'SIRVD_network_sweep', is_dynamic = False, lockdowns = None, events = None,
+                               target_higher = False, target_lower = False, engine = 'agent', seed = None, workers = None,
+                               graph_cache = None):
+
+    model_params = {'N': POPULATION, 'infection_rate': infection_rate, 'recovery_rate': recovery_rate,
+                    'fatality_rate': fatality_rate, 'vaccination_rate': vaccination_rate, 'breakthrough_rate': breakthrough_rate,
+                    'graph_type': graph_type, 'graph_params': graph_parameters, 'delta_t': delta_days, 'is_dynamic': is_dynamic,
+                    'engine': engine}
+    run_params = {'initial_infectious': initial_infected, 'simulation_time': simulation_time, 'lockdowns': lockdowns,
+                  'events': events, 'target_higher': target_higher, 'target_lower': target_lower}
+
+    return run_sweep(SIRVD_NetworkConstantParameters, model_params, run_params, grid, result_directory=result_directory,
+                     seed=seed, workers=workers, graph_cache=graph_cache)
+
+
 def run_compartmental_model(infection_rate, vaccination_rate, fatality_rate, breakthrough_rate, recovery_rate, 
-                             simulation_time, delta_days, initial_infected, result_file = 'SIRVD_network_constant.json'):
+                             simulation_time, delta_days, initial_infected, result_file = 'SIRVD_compartmental.sirvd'):
     
     sirvd_model = SIRVD_CompartmentalModel(N=POPULATION, beta=infection_rate, mu=recovery_rate, nu=vaccination_rate,
                                             psi=fatality_rate, sigma=breakthrough_rate, delta_t=delta_days)
@@ -46,6 +82,34 @@ def run_compartmental_model(infection_rate, vaccination_rate, fatality_rate, bre
                                result_filename=result_file)
 
 
+def run_pair_approximation_model(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
+                                 breakthrough_rate, recovery_rate, simulation_time, delta_days, initial_infected,
+                                 result_file = 'SIRVD_pair_approximation.sirvd', target_higher = False, target_lower = False,
+                                 approximation = 'pair', graph_seed = None, graph_cache = None):
+
+    sirvd_model = SIRVD_PairApproximationModel(N=POPULATION, infection_rate=infection_rate, recovery_rate=recovery_rate,
+                                               fatality_rate=fatality_rate, vaccination_rate=vaccination_rate,
+                                               breakthrough_rate=breakthrough_rate, graph_type=graph_type, graph_params=graph_parameters,
+                                               delta_t=delta_days, approximation=approximation, graph_seed=graph_seed,
+                                               graph_cache=graph_cache)
+
+    sirvd_model.run_simulation(initial_infectious=initial_infected, simulation_time=simulation_time,
+                               result_filename=result_file, target_higher=target_higher, target_lower=target_lower)
+
+
+def run_network_calibration(graph_type, graph_parameters, country, variable_parameters, delta_days, replicates,
+                            result_directory = 'SIRVD_network_calibration', is_dynamic = False, lockdowns = None, events = None,
+                            engine = 'agent', seed = None, workers = None, graph_cache = None, segment_days = 28):
+
+    network_params = {'N': POPULATION, 'graph_type': graph_type, 'graph_params': graph_parameters, 'delta_t': delta_days,
+                      'is_dynamic': is_dynamic, 'engine': engine, 'graph_cache': graph_cache}
+    run_params = {'lockdowns': lockdowns, 'events': events}
+
+    return calibrate(variable_parameters, get_country_population(country), network_params, run_params,
+                     segment_days=segment_days, replicates=replicates, result_directory=result_directory, seed=seed,
+                     workers=workers)
+
+
 def get_variable_parameters(filename, country, start_time, end_time, 
                             average_backthrough_time, average_recovery_time) -> dict:
 
@@ -60,7 +124,11 @@ if __name__ == '__main__':
 
     enable_compartmental_model = False
     enable_network_constant_model = True
+    enable_pair_approximation_model = False
     enable_network_variable_model = False
+    enable_network_ensemble = False
+    enable_network_sweep = False
+    enable_network_calibration = False
 
     # Network Info
     graph_type = 'stochastic_block_model'
@@ -73,6 +141,7 @@ if __name__ == '__main__':
     is_dynamic = True
     target_higher = False
     target_lower = False
+    engine = 'agent' # 'agent', 'frontier', 'vectorized', 'event' or 'partitioned' (static networks on all cores)
 
     # SIRVD constant Model parameters
     infection_rate = 0.5
@@ -86,6 +155,17 @@ if __name__ == '__main__':
     delta_days = 1 # Step of simulation
     initial_infected = 200
 
+    # For ensembles
+    replicates = 100
+    seed = 42
+    workers = None # All available cores
+    share_graph = True # Same network for all replicates
+    graph_cache = 'Data/cache/graphs' # Directory of the cached networks, None to disable
+
+    # For sweeps, every combination of the listed values; any model or run parameter can be listed
+    sweep_grid = {'infection_rate': [0.3, 0.5, 0.7], 'vaccination_rate': [0.01, 0.03],
+                  'lockdowns': [[(15, 60)], [(15, 30), (60, 90)]]}
+
     # For Dynamic network
     lockdowns = [(15, 60)]
     events = [(1, 10)]
@@ -96,13 +176,17 @@ if __name__ == '__main__':
     end_time = datetime(2022, 12, 31)
     average_backtrhrough_time = 30
     average_recovery_time = 7
+    calibration_segment_days = 28 # Days of every piecewise-constant fitted rate
+
+    # Plots
+    plot_directory = None # Directory where the figures are saved without being shown, None to show them
 
-    plotter = SIRVD_Plotter()
+    plotter = SIRVD_Plotter(plot_directory)
 
     if enable_compartmental_model:
         print("SIMULATING COMPARTMENTAL MODEL")
     
-        compartimental_result_file = 'Data/Compartimental_result_file_variable2.json'
+        compartimental_result_file = 'Data/Compartimental_result_file_variable2.sirvd'
 
         run_compartmental_model(infection_rate, vaccination_rate, fatality_rate, breakthrough_rate, recovery_rate, duration, delta_days, initial_infected, compartimental_result_file)
 
@@ -112,20 +196,32 @@ if __name__ == '__main__':
     if enable_network_constant_model:
         print("SIMULATING CONSTANT PARAMETERS NETWORK")
 
-        constant_network_result_file = 'Data/Constant_network_result_file_wsboth.json'
+        constant_network_result_file = 'Data/Constant_network_result_file_wsboth.sirvd'
 
         run_constant_network_model(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
                                    breakthrough_rate, recovery_rate, duration, delta_days, initial_infected, constant_network_result_file,
-                                   is_dynamic, lockdowns, events, target_higher, target_lower)
+                                   is_dynamic, lockdowns, events, target_higher, target_lower, engine)
     
 
         plotter.plot_from_file(constant_network_result_file, 'Watts Strogatz Network Simulation')
 
 
+    if enable_pair_approximation_model:
+        print("SIMULATING PAIR APPROXIMATION OF THE NETWORK")
+
+        pair_approximation_result_file = 'Data/Pair_approximation_result_file.sirvd'
+
+        run_pair_approximation_model(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
+                                     breakthrough_rate, recovery_rate, duration, delta_days, initial_infected,
+                                     pair_approximation_result_file, target_higher, target_lower, 'pair', seed, graph_cache)
+
+        plotter.plot_from_file(pair_approximation_result_file, 'Pair Approximation of the Network')
+
+
     if enable_network_variable_model:
         print("SIMULATING VARIABLE PARAMETERS NETWORK")
 
-        variable_network_result_file = 'Data/Variable_network_result_file_er3.json'
+        variable_network_result_file = 'Data/Variable_network_result_file_er3.sirvd'
 
         variable_parameter_file = 'Data/COVID_parameter.json'
 
@@ -136,7 +232,47 @@ if __name__ == '__main__':
 
         run_dynamic_network_model(graph_type, graph_parameters, variable_parameters['InfectionRate'], variable_parameters['VaccinationRate'],
                                   variable_parameters['FatalityRate'], variable_parameters['BreakthroughRate'], variable_parameters['RecoveryRate'],
-                                  effective_duration, delta_days, initial_infected, variable_network_result_file, is_dynamic, lockdowns, events, target_higher, target_lower)
+                                  effective_duration, delta_days, initial_infected, variable_network_result_file, is_dynamic, lockdowns, events, target_higher, target_lower, engine)
     
         plotter.plot_from_file(variable_network_result_file, 'Erdos Renyi Variable Network Simulation')
 
+
+    if enable_network_ensemble:
+        print("SIMULATING CONSTANT PARAMETERS NETWORK ENSEMBLE")
+
+        ensemble_result_file = 'Data/Constant_network_ensemble.json'
+
+        run_constant_network_ensemble(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
+                                      breakthrough_rate, recovery_rate, duration, delta_days, initial_infected, replicates,
+                                      ensemble_result_file, is_dynamic, lockdowns, events, target_higher, target_lower, engine,
+                                      seed, workers, share_graph, graph_cache)
+
+        plotter.plot_from_file(ensemble_result_file, 'Constant Network Ensemble')
+
+
+    if enable_network_sweep:
+        print("SIMULATING CONSTANT PARAMETERS NETWORK SWEEP")
+
+        sweep_result_directory = 'Data/Constant_network_sweep'
+
+        run_constant_network_sweep(graph_type, graph_parameters, infection_rate, vaccination_rate, fatality_rate,
+                                   breakthrough_rate, recovery_rate, duration, delta_days, initial_infected, sweep_grid,
+                                   sweep_result_directory, is_dynamic, lockdowns, events, target_higher, target_lower, engine,
+                                   seed, workers, graph_cache)
+
+
+    if enable_network_calibration:
+        print("CALIBRATING VARIABLE PARAMETERS NETWORK")
+
+        calibration_result_directory = 'Data/Variable_network_calibration'
+
+        variable_parameter_file = 'Data/COVID_parameter.json'
+
+        variable_parameters = get_variable_parameters(variable_parameter_file, country,
+                                                     start_time, end_time, average_backtrhrough_time, average_recovery_time)
+
+        calibration = run_network_calibration(graph_type, graph_parameters, country, variable_parameters, delta_days, replicates,
+                                              calibration_result_directory, is_dynamic, lockdowns, events, engine, seed, workers,
+                                              graph_cache, calibration_segment_days)
+
+        plotter.plot_from_file(calibration['result_file'], 'Calibrated Variable Network Ensemble')
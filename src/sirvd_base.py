@@ -1,8 +1,9 @@
 import numpy as np
 from enum import Enum
 from abc import ABC, abstractmethod
-import json
 import sys
+from sirvd_result_sink import ResultWriter, ResultReader, export_json, DEFAULT_CHUNK_SIZE
+from sirvd_metrics import EpidemicMetrics, DEFAULT_INFECTED_THRESHOLD
 
 '''This module defines the basic functioning structure of a SIRVD simulation model. In particular it defines the execution structure and 
    the computation of results data.'''
@@ -14,18 +15,22 @@ class State(Enum):
     DEAD = "D"
 
 
+STATE_CODES = {state: code for code, state in enumerate(State)}
+
+
 class SIRVD_Base(ABC):
     def __init__(self, N: int, delta_t: int = 1):
 
         self.delta_t = delta_t
         self.time = 0
 
-        self.observables = {'Time': [], State.SUSCEPTIBLE: [], State.INFECTED:[], State.RECOVERED :[], State.VACCINATED :[], State.DEAD :[]}
-        self.daily_new_inftected = []
         self.population = N
+        self.__allocate_observables(0)
 
+    # Live compartment totals, as a dictionary from State to the number of people in it
+    @property
     @abstractmethod
-    def _record_state(self):
+    def counts(self):
         pass
 
     @abstractmethod
@@ -40,79 +45,145 @@ class SIRVD_Base(ABC):
     def _initialize_infection(self, number_of_infectious, target_higher, target_lower):
         pass
 
+    # NumPy type of the compartment counts and new infections in the result file
+    def _count_dtype(self):
+        return np.int64
 
-    def __extract_additional_data(self):
 
-        self.epidemy_duration = len(self.observables['Time'])
-        for t in range(len(self.observables['Time'])):
-            if self.observables[State.INFECTED][t] < 1 and t > 0:
-                self.epidemy_duration = self.observables['Time'][t]
-                break
+    # Observables live in preallocated arrays and self.row is the position of the current step in them: the whole run
+    # when results stay in memory, a single reused chunk when they are streamed to a file
+    def __allocate_observables(self, rows):
 
-        # Reproduction rate extraction
+        self.observables = {'Time': np.zeros(rows, dtype=np.float64 if isinstance(self.delta_t, float) else np.int64)}
+        for state in State:
+            self.observables[state] = np.zeros(rows, dtype=self._count_dtype())
+        self.daily_new_inftected = np.zeros(rows, dtype=self._count_dtype())
+        self.row = 0
 
-        self.reproduction_rate = [0]
-        for t in range(1, self.epidemy_duration):
-            new_infected = self.daily_new_inftected[t]
-            reproduction_rate = abs(new_infected) / self.observables[State.INFECTED][t-1]
-            self.reproduction_rate.append(reproduction_rate)
 
-        infected_peak_index = np.argmax(self.observables[State.INFECTED])
-        self.infected_peak_time = self.observables['Time'][infected_peak_index]
-        self.infected_peak = self.observables[State.INFECTED][self.infected_peak_time]
+    def _record_state(self):
 
-        total_number_of_infected = sum(self.daily_new_inftected)
-        self.case_fatality_rate = self.observables[State.DEAD][-1] / total_number_of_infected
+        counts = self.counts
+        for state in State:
+            self.observables[state][self.row] = counts[state]
+        self.observables['Time'][self.row] = self.time
 
 
-    def run_simulation(self, initial_infectious, simulation_time, result_filename = "simulation_results.json", lockdowns = None, events = None,
-                       target_higher = False, target_lower = False):
+    # Value of an observable at the last recorded step; right after a chunk is written the row is 0, and the last row
+    # of the chunk, at index -1, is still the previous step
+    def _last_recorded(self, key):
+        return self.observables[key][self.row - 1]
 
-        self._initialize_infection(initial_infectious, target_higher, target_lower)
 
-        self.daily_new_inftected.append(initial_infectious)
+    # Records the current step in the observables and in the online metrics, then moves to the next row
+    def __record_step(self):
+
         self._record_state()
+        self.__metrics.update(self.observables['Time'][self.row], self.observables[State.INFECTED][self.row],
+                              self.observables[State.DEAD][self.row], self.daily_new_inftected[self.row])
+        self.__next_row()
+
+
+    def __set_additional_data(self, metrics: dict):
+
+        for name, value in metrics.items():
+            setattr(self, name, value)
+
+
+    def run_simulation(self, initial_infectious, simulation_time, result_filename = "simulation_results.sirvd", lockdowns = None, events = None,
+                       target_higher = False, target_lower = False, verbose = True, json_filename = None,
+                       chunk_size = DEFAULT_CHUNK_SIZE, infected_threshold = DEFAULT_INFECTED_THRESHOLD):
 
         steps_number = int(np.round(simulation_time/self.delta_t))
 
+        # With a result file the steps are streamed to it chunk by chunk, and only the unwritten tail of the
+        # observables stays in memory during the run; once it ends the observables are the whole series again, mapped
+        # from the file. Without one the whole run is kept in memory
+        self.__writer = None
+        if result_filename is not None:
+            self.__allocate_observables(min(chunk_size, steps_number + 1))
+            self.__writer = ResultWriter(result_filename, self.__result_columns())
+        else:
+            self.__allocate_observables(steps_number + 1)
+
+        # Metrics are updated at every step, so neither the observables nor the result file are scanned again
+        self.__metrics = EpidemicMetrics(self.population, self.delta_t, infected_threshold)
+
+        self._initialize_infection(initial_infectious, target_higher, target_lower)
+
+        self.daily_new_inftected[self.row] = initial_infectious
+        self.__record_step()
+
         for t in range(steps_number):
             self.time += self.delta_t
             
-            self.daily_new_inftected.append(0)
             self._evolve(lockdowns, events)
-            self._record_state()
-            self.__update_user_time()
+            self.__record_step()
+            if verbose:
+                self.__update_user_time()
         
-        print('\nSimulation Terminated')
+        if verbose:
+            print('\nSimulation Terminated')
+
+        self.__set_additional_data(self.__metrics.result())
+        if self.__writer is None:
+            return
+
+        self.__writer.write(self.__result_columns(self.row))
+        self.__save_results(result_filename, json_filename, verbose)
+        self.__load_results(result_filename)
+
+
+    # Without a row count, the column types of the result file; with it, the first rows of every column
+    def __result_columns(self, rows = None):
+
+        columns = {(key.value if isinstance(key, State) else key): values for key, values in self.observables.items()}
+        columns['new_infected'] = self.daily_new_inftected
+        if rows is None:
+            return {name: values.dtype for name, values in columns.items()}
+        return {name: values[:rows] for name, values in columns.items()}
+
+
+    def __next_row(self):
+
+        self.row += 1
+        if self.__writer is not None and self.row == len(self.daily_new_inftected):
+            self.__writer.write(self.__result_columns(self.row))
+            self.daily_new_inftected[:] = 0
+            self.row = 0
+
+
+    # Replaces the last chunk with read-only views of every step in the result file, as ResultReader maps them
+    def __load_results(self, filename):
+
+        columns = ResultReader(filename).columns
+        self.observables = {'Time': columns['Time']}
+        for state in State:
+            self.observables[state] = columns[state.value]
+        self.daily_new_inftected = columns['new_infected']
+        self.row = len(self.daily_new_inftected)
 
-        self.__extract_additional_data()
-        self.__save_results(result_filename)
-        
 
-    def __save_results(self, filename):
-        observables_result = {}
-        for key, value_list in self.observables.items():
-            if isinstance(key, State):
-                observables_result[key.value] = value_list
-            else:
-                observables_result[key] = value_list
+    def __save_results(self, filename, json_filename = None, verbose = True):
 
-        results = {
-            'observables': observables_result,
+        self.__writer.close({
             'additional_data': {
                 'reproduction_rate': self.reproduction_rate,
                 'infected_peak_time': self.infected_peak_time,
                 'infected_peak': self.infected_peak,
                 'epidemy_duration': self.epidemy_duration,
-                'case_fatality_rate': self.case_fatality_rate
+                'case_fatality_rate': self.case_fatality_rate,
+                'attack_rate': self.attack_rate,
+                'time_to_threshold': self.time_to_threshold
             },
             'parameters': self._get_simulation_parameters()
-        }
+        })
 
-        with open(filename, 'w') as f:
-            json.dump(results, f)
+        if json_filename is not None:
+            export_json(filename, json_filename)
 
-        print(f"Result save in the file: {filename}")
+        if verbose:
+            print(f"Result save in the file: {filename}")
 
     
     def __update_user_time(self):
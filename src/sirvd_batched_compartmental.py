@@ -0,0 +1,228 @@
+import numpy as np
+import sys
+from sirvd_base import State
+from sirvd_metrics import compute_metrics, DEFAULT_INFECTED_THRESHOLD
+from sirvd_result_sink import ResultWriter, export_json
+from sirvd_schedule import RunLengthSchedule
+
+SUSCEPTIBLE, INFECTED, RECOVERED, VACCINATED, DEAD, CUMULATIVE_INFECTED = range(6)
+
+# Dormand-Prince 5(4) tableau
+DORMAND_PRINCE_A = ((),
+                    (1 / 5,),
+                    (3 / 40, 9 / 40),
+                    (44 / 45, -56 / 15, 32 / 9),
+                    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+                    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+                    (35 / 384, 0., 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84))
+DORMAND_PRINCE_ERROR = (71 / 57600, 0., -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+
+'''This module integrates the compartmental SIRVD model for a whole batch of parameter sets at once: every rate and the
+   initial infected may be an array, and the compartments of all the members are advanced together as NumPy arrays.
+   Besides forward Euler, which reproduces SIRVD_CompartmentalModel exactly, a step can be taken with RK4 or with an
+   adaptive Dormand-Prince 5(4) integrator that splits each step into as many substeps as every member needs to stay
+   within the tolerance, so that larger steps keep the same error. Each member can be written to a result file with
+   the same observables and schema as the single compartmental model. Rates may also be daily schedules, so that a
+   batch of candidate piecewise-constant rates runs at once.'''
+class BatchedCompartmentalModel:
+    def __init__(self, N, beta, mu, nu, psi, sigma, delta_t, integrator: str = 'euler', tolerance: float = 1e-6):
+
+        if integrator not in ('euler', 'rk4', 'adaptive'):
+            print("Unsupported integrator")
+            exit()
+
+        self.population = N
+        self.delta_t = delta_t
+        self.integrator = integrator
+        self.tolerance = tolerance
+
+        # A rate is one value for the batch, one per member, or a schedule with a row per day and a column per member,
+        # which is read at the time of each step as the variable network model reads its schedules
+        rates = [np.asarray(rate, dtype=np.float64) for rate in (beta, mu, nu, psi, sigma)]
+        self.is_variable = any(rate.ndim == 2 for rate in rates)
+        self.rate_schedules = np.broadcast_arrays(*(rate.reshape((1, -1)) if rate.ndim < 2 else rate for rate in rates))
+        self.batch_size = self.rate_schedules[0].shape[1]
+        self.__set_rates(0)
+
+        self.time = 0
+        self.observables = dict()
+        self.additional_data = dict()
+        self.__step_sizes = None
+
+
+    def __set_rates(self, time):
+        self.beta, self.mu, self.nu, self.psi, self.sigma = (schedule[time] for schedule in self.rate_schedules)
+
+
+    def __derivatives(self, y, members = slice(None)):
+
+        # Same terms and order of operations as SIRVD_CompartmentalModel, plus the cumulative new infections
+        S, I, R, V, D = y[SUSCEPTIBLE], y[INFECTED], y[RECOVERED], y[VACCINATED], y[DEAD]
+        beta, mu, nu, psi, sigma = (self.beta[members], self.mu[members], self.nu[members], self.psi[members],
+                                    self.sigma[members])
+
+        N_total = S + D + R + I + V
+        new_infected = beta * S * I / N_total
+        return np.array([-new_infected - nu * S + sigma * R, new_infected - mu * I - psi * I, mu * I - sigma * R,
+                         nu * S, psi * I, new_infected])
+
+
+    # Advances every member by delta_t; returns the new state and the new infections per unit time over the step
+    def __step(self, y):
+
+        delta_t = self.delta_t
+        if self.is_variable:
+            self.__set_rates(int(self.time))
+
+        if self.integrator == 'euler':
+            k1 = self.__derivatives(y)
+            return (k1 * delta_t) + y, k1[CUMULATIVE_INFECTED]
+
+        if self.integrator == 'rk4':
+            k1 = self.__derivatives(y)
+            k2 = self.__derivatives(y + delta_t / 2 * k1)
+            k3 = self.__derivatives(y + delta_t / 2 * k2)
+            k4 = self.__derivatives(y + delta_t * k3)
+            y_next = y + delta_t / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        else:
+            y_next = self.__adaptive_step(y)
+
+        return y_next, (y_next[CUMULATIVE_INFECTED] - y[CUMULATIVE_INFECTED]) / delta_t
+
+
+    def __adaptive_step(self, y):
+
+        # Every member keeps its own substep size between calls; members that reached the end of the step drop out,
+        # so each substep only evaluates the members still integrating
+        y = y.copy()
+        elapsed = np.zeros(self.batch_size)
+        if self.__step_sizes is None:
+            self.__step_sizes = np.full(self.batch_size, float(self.delta_t))
+
+        active = np.arange(self.batch_size)
+        while len(active) > 0:
+            remaining = self.delta_t - elapsed[active]
+            h = np.minimum(self.__step_sizes[active], remaining)
+            y_active = y[:, active]
+
+            stages = []
+            for coefficients in DORMAND_PRINCE_A:
+                stage_y = y_active + h * sum((a * stage for a, stage in zip(coefficients, stages)), np.zeros_like(y_active))
+                stages.append(self.__derivatives(stage_y, active))
+            y_next = y_active + h * sum(b * stage for b, stage in zip(DORMAND_PRINCE_A[-1], stages))
+            error = h * sum(e * stage for e, stage in zip(DORMAND_PRINCE_ERROR, stages))
+
+            scale = self.tolerance + self.tolerance * np.maximum(np.abs(y_active), np.abs(y_next))
+            error_norm = np.sqrt(np.mean((error / scale) ** 2, axis=0))
+
+            accepted = error_norm <= 1.
+            y[:, active[accepted]] = y_next[:, accepted]
+            elapsed[active[accepted]] += h[accepted]
+
+            with np.errstate(divide='ignore'):
+                factor = np.clip(0.9 * error_norm ** -0.2, 0.2, 5.)
+            # A step shortened to reach the end of the interval keeps the size the error control asked for
+            self.__step_sizes[active] = np.where(accepted & (h < self.__step_sizes[active]), self.__step_sizes[active],
+                                                 h * factor)
+
+            active = active[elapsed[active] < self.delta_t * (1 - 1e-12)]
+
+        return y
+
+
+    def run_simulation(self, initial_infectious, simulation_time, result_filename = None, verbose = True,
+                       infected_threshold = DEFAULT_INFECTED_THRESHOLD):
+
+        steps_number = int(np.round(simulation_time/self.delta_t))
+        initial_infectious = np.broadcast_to(np.asarray(initial_infectious, dtype=np.float64), (self.batch_size,))
+
+        if self.is_variable and int(steps_number * self.delta_t) >= len(self.rate_schedules[0]):
+            print('Error: simulation time longer than available parameters data')
+            exit()
+
+        self.observables = {'Time': np.zeros(steps_number + 1, dtype=np.float64 if isinstance(self.delta_t, float) else np.int64),
+                            'new_infected': np.zeros((steps_number + 1, self.batch_size))}
+        for state in State:
+            self.observables[state] = np.zeros((steps_number + 1, self.batch_size))
+
+        y = np.zeros((6, self.batch_size))
+        y[INFECTED] = initial_infectious
+        y[SUSCEPTIBLE] = self.population - initial_infectious
+        self.__record_state(0, y, initial_infectious)
+
+        for step in range(1, steps_number + 1):
+            self.time += self.delta_t
+            y, new_infected = self.__step(y)
+            self.__record_state(step, y, new_infected)
+
+            if verbose:
+                sys.stdout.write(f"\rSimulation at time {self.time}")
+                sys.stdout.flush()
+
+        if verbose:
+            print('\nSimulation Terminated')
+
+        self.additional_data = compute_metrics(self.observables['Time'], self.observables[State.INFECTED],
+                                               self.observables[State.DEAD], self.observables['new_infected'],
+                                               self.population, self.delta_t, infected_threshold)
+
+        if result_filename is not None:
+            self.__save_results(result_filename, verbose)
+
+
+    def __record_state(self, step, y, new_infected):
+
+        self.observables['Time'][step] = self.time
+        for state, index in zip(State, (SUSCEPTIBLE, INFECTED, RECOVERED, VACCINATED, DEAD)):
+            self.observables[state][step] = y[index]
+        self.observables['new_infected'][step] = new_infected
+
+
+    def __save_results(self, filename, verbose = True):
+
+        arrays = {(key.value if isinstance(key, State) else key): values for key, values in self.observables.items()}
+        rates = {name: schedule if self.is_variable else schedule[0]
+                 for name, schedule in zip(('beta', 'mu', 'nu', 'psi', 'sigma'), self.rate_schedules)}
+        np.savez_compressed(filename, **arrays, **self.additional_data, **rates)
+
+        if verbose:
+            print(f"Result save in the file: {filename}")
+
+
+    # Writes one member of the batch as SIRVD_CompartmentalModel would write its results
+    def save_member(self, member: int, result_filename: str, json_filename: str = None):
+
+        columns = {'Time': self.observables['Time']}
+        for state in State:
+            columns[state.value] = self.observables[state][:, member]
+        columns['new_infected'] = self.observables['new_infected'][:, member]
+
+        # The reproduction rate stops where the epidemic ends, as in the single model
+        infected = self.observables[State.INFECTED][:, member]
+        below = np.flatnonzero(infected[1:] < 1)
+        end = below[0] + 1 if len(below) > 0 else len(infected)
+
+        additional_data = {name: values[member] for name, values in self.additional_data.items() if name != 'reproduction_rate'}
+        additional_data = {'reproduction_rate': [0] + self.additional_data['reproduction_rate'][1:end, member].tolist(),
+                           'infected_peak_time': additional_data['infected_peak_time'],
+                           'infected_peak': additional_data['infected_peak'],
+                           'epidemy_duration': additional_data['epidemy_duration'],
+                           'case_fatality_rate': additional_data['case_fatality_rate'],
+                           'attack_rate': additional_data['attack_rate'],
+                           'time_to_threshold': additional_data['time_to_threshold']}
+
+        # Schedules are written whole and run-length encoded, as SIRVD_NetworkVariableParameters writes them
+        parameters = dict()
+        for name, schedule in zip(('infection_rate', 'recovery_rate', 'fatality_rate', 'vaccination_rate', 'breakthrough_rate'),
+                                  (self.rate_schedules[i] for i in (0, 1, 3, 2, 4))):
+            if self.is_variable:
+                parameters[name] = RunLengthSchedule.from_sequence(schedule[:, member]).to_dict()
+            else:
+                parameters[name] = RunLengthSchedule.constant(schedule[0, member], self.time).to_dict()
+
+        writer = ResultWriter(result_filename, {name: values.dtype for name, values in columns.items()})
+        writer.write(columns)
+        writer.close({'additional_data': additional_data, 'parameters': parameters})
+
+        if json_filename is not None:
+            export_json(result_filename, json_filename)
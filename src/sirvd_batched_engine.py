@@ -0,0 +1,126 @@
+import numpy as np
+import sys
+from sirvd_base import State, STATE_CODES
+from sirvd_metrics import compute_metrics, DEFAULT_INFECTED_THRESHOLD
+from sirvd_rng import CounterRNG
+from sirvd_vectorized_engine import apply_transitions, vaccination_hazard, vaccination_thresholds, SUSCEPTIBLE, INFECTED
+
+'''This module runs many realisations of a network SIRVD model on the same static graph in one pass. States are held
+   as a (nodes x replicates) matrix, so the infected-neighbour counts of all replicates come from a single sparse-matrix
+   times dense-matrix product per step. Replicate r draws the counter-based numbers of the model built with the same
+   seed and replicate=r, so it follows the same trajectory as that single run with extinction='simulate'.'''
+class BatchedEngine:
+    def __init__(self, model, replicates: int, seed: int = None):
+
+        if model.is_dynamic:
+            print('Error: batched replicates require a static network')
+            exit()
+
+        self.model = model
+        self.replicates = replicates
+        self.seed = seed
+
+        # Without a seed the replicates continue the dynamics of the model; with one, the dynamics seed a model built
+        # with it would have
+        dynamics_seed = model.dynamics_seed if seed is None else int(np.random.SeedSequence(seed).generate_state(4)[1])
+        self.randoms = [CounterRNG(dynamics_seed, replicate) for replicate in range(replicates)]
+
+        self.adjacency = model.adjacency(np.float32)
+        self.degree = np.diff(self.adjacency.indptr).astype(np.float64)[:, None]
+
+        self.states = np.full((model.population, replicates), SUSCEPTIBLE, dtype=np.int8)
+        self.hazard = 0.
+        self.thresholds = np.stack([vaccination_thresholds(random.uniform(0, 'vaccination', 0, model.population), 0.)
+                                    for random in self.randoms], axis=1)
+        self.time = 0
+        self.observables = dict()
+        self.additional_data = dict()
+
+
+    def __initialize_infection(self, number_of_infectious, target_higher, target_lower):
+
+        if target_higher or target_lower:
+            degree = self.degree[:, 0]
+            order = np.argsort(-degree if target_higher else degree, kind='stable')
+            self.states[order[:number_of_infectious], :] = INFECTED
+            return
+
+        for replicate, random in enumerate(self.randoms):
+            numbers = random.uniform(0, 'initial_infection', 0, self.model.population)
+            self.states[np.argsort(numbers, kind='stable')[:number_of_infectious], replicate] = INFECTED
+
+
+    def __record_state(self, step, new_infected):
+
+        self.observables['Time'][step] = self.time
+        for state, code in STATE_CODES.items():
+            self.observables[state][step] = np.count_nonzero(self.states == code, axis=0)
+        self.observables['new_infected'][step] = new_infected
+
+
+    def __step(self, step: int, infection_rate: float, vaccination_rate: float, fatality_rate: float,
+               recovery_rate: float, breakthrough_rate: float):
+
+        states = self.states
+        infected_neighbors = (self.adjacency @ (states == INFECTED).astype(np.float32)).astype(np.float64)
+
+        random_numbers = np.empty((self.replicates, states.shape[0]))
+        for replicate, random in enumerate(self.randoms):
+            random_numbers[replicate] = random.uniform(step, 'transition', 0, states.shape[0])
+        random_numbers = random_numbers.T
+
+        self.hazard += vaccination_hazard(vaccination_rate * self.model.delta_t)
+
+        masks = apply_transitions(states, infected_neighbors, self.degree, self.model.delta_t, random_numbers,
+                                  self.thresholds, self.hazard, infection_rate, vaccination_rate, fatality_rate,
+                                  recovery_rate, breakthrough_rate)
+        for replicate, random in enumerate(self.randoms):
+            waned = np.flatnonzero(masks[-1][:, replicate])
+            self.thresholds[waned, replicate] = vaccination_thresholds(random.at(step, 'vaccination', waned), self.hazard)
+        return np.count_nonzero(masks[0], axis=0)
+
+
+    def run_simulation(self, initial_infectious, simulation_time, result_filename = "batched_results.npz",
+                       target_higher = False, target_lower = False, verbose = True,
+                       infected_threshold = DEFAULT_INFECTED_THRESHOLD):
+
+        steps_number = int(np.round(simulation_time/self.model.delta_t))
+
+        self.observables = {'Time': np.zeros(steps_number + 1, dtype=np.float64 if isinstance(self.model.delta_t, float) else np.int64),
+                            'new_infected': np.zeros((steps_number + 1, self.replicates), dtype=np.int32)}
+        for state in State:
+            self.observables[state] = np.zeros((steps_number + 1, self.replicates), dtype=np.int32)
+
+        self.__initialize_infection(initial_infectious, target_higher, target_lower)
+        self.__record_state(0, initial_infectious)
+
+        for step in range(1, steps_number + 1):
+            self.time += self.model.delta_t
+
+            rates = self.model._get_rates(self.time)
+            new_infected = self.__step(step, *rates) if rates is not None else 0
+            self.__record_state(step, new_infected)
+
+            if verbose:
+                sys.stdout.write(f"\rSimulation at time {self.time}")
+                sys.stdout.flush()
+
+        if verbose:
+            print('\nSimulation Terminated')
+
+        # One value per replicate for every metric, and a (steps x replicates) reproduction rate
+        self.additional_data = compute_metrics(self.observables['Time'], self.observables[State.INFECTED],
+                                               self.observables[State.DEAD], self.observables['new_infected'],
+                                               self.model.population, self.model.delta_t, infected_threshold)
+
+        if result_filename is not None:
+            self.__save_results(result_filename, verbose)
+
+
+    def __save_results(self, filename, verbose = True):
+
+        arrays = {(key.value if isinstance(key, State) else key): values for key, values in self.observables.items()}
+        np.savez_compressed(filename, **arrays, **self.additional_data, replicates=self.replicates)
+
+        if verbose:
+            print(f"Result save in the file: {filename}")
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from sirvd_base import State
+from sirvd_batched_compartmental import BatchedCompartmentalModel
+from sirvd_ensemble import run_ensemble
+from sirvd_network_variable_parameters import SIRVD_NetworkVariableParameters
+
+RATE_COLUMNS = {'infection_rate': 'InfectionRate', 'recovery_rate': 'RecoveryRate', 'fatality_rate': 'FatalityRate',
+                'vaccination_rate': 'VaccinationRate', 'breakthrough_rate': 'BreakthroughRate'}
+FITTED_RATES = ('infection_rate', 'vaccination_rate', 'fatality_rate')
+OBSERVED_STATES = (State.SUSCEPTIBLE, State.INFECTED, State.RECOVERED, State.VACCINATED, State.DEAD)
+MINIMUM_RATE = 1e-5
+CHECKPOINT_FILENAME = 'checkpoint.json'
+CHECKPOINT_VERSION = 1
+
+'''This module calibrates the variable parameters network model against the observables extracted by DataExtractor.
+   The fitted rates are piecewise constant over segments of a number of days, each one searched within a factor of
+   the mean of the rates inverted from the data on that segment, while the other rates follow the extracted daily
+   values. Candidates are screened in rounds on the batched compartmental model, every round sampling around the best
+   ones of the previous, and the best candidates found are refined with network ensembles run across the cores. A
+   checkpoint in the result directory records the rounds and the ensembles already completed, so an interrupted
+   calibration resumes where it stopped.'''
+def calibration_loss(simulated, observed, weights = None):
+
+    # Simulated has the states on the first axis, the days on the second and any further axis holds candidates. Both
+    # start from the initial infected alone, as the network model does, so the curves are compared as changes from the
+    # first day, each one relative to the size of its observed change
+    observed = np.asarray(observed, dtype=np.float64)
+    simulated = np.asarray(simulated, dtype=np.float64)
+    observed_change = observed - observed[:, :1]
+    simulated_change = simulated - simulated[:, :1]
+
+    scale = np.maximum(np.mean(observed_change ** 2, axis=1), 1e-12)
+    scale = scale.reshape(scale.shape + (1,) * (simulated.ndim - 2))
+    errors = np.mean((simulated_change - observed_change.reshape(observed_change.shape + (1,) * (simulated.ndim - 2))) ** 2,
+                     axis=1) / scale
+
+    weights = np.ones(len(observed)) if weights is None else np.asarray(weights, dtype=np.float64)
+    return np.tensordot(weights / np.sum(weights), errors, axes=1)
+
+
+def _segments(days: int, segment_days: int):
+
+    starts = np.arange(0, days, segment_days)
+    return starts, np.diff(np.append(starts, days))
+
+
+def _rate_schedules(x, prior, fixed_rates: dict, fitted_rates, run_lengths):
+
+    # x holds the log-factors of the candidates from the prior, segment by segment for every fitted rate
+    x = np.asarray(x).reshape((-1, len(fitted_rates), len(run_lengths)))
+    schedules = {name: schedule[:, None] for name, schedule in fixed_rates.items()}
+    for index, name in enumerate(fitted_rates):
+        schedules[name] = np.repeat((prior[index] * np.exp(x[:, index])).T, run_lengths, axis=0)
+    return schedules
+
+
+def _surrogate_losses(x, prior, fixed_rates, fitted_rates, run_lengths, observed, population, initial_infectious,
+                      integrator, weights):
+
+    schedules = _rate_schedules(x, prior, fixed_rates, fitted_rates, run_lengths)
+    model = BatchedCompartmentalModel(population, beta=schedules['infection_rate'], mu=schedules['recovery_rate'],
+                                      nu=schedules['vaccination_rate'], psi=schedules['fatality_rate'],
+                                      sigma=schedules['breakthrough_rate'], delta_t=1, integrator=integrator)
+    model.run_simulation(initial_infectious, observed.shape[1] - 1, verbose=False)
+
+    simulated = np.array([model.observables[state] for state in OBSERVED_STATES]) / population
+    return calibration_loss(simulated, observed, weights)
+
+
+def _save_checkpoint(filename: str, checkpoint: dict):
+
+    # Replaced in one step, so an interruption never leaves a partial checkpoint
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', suffix='.json')
+    with os.fdopen(descriptor, 'w') as f:
+        json.dump(checkpoint, f, indent=4)
+    os.replace(temporary, filename)
+
+
+def calibrate(observations: dict, population: int, network_params: dict, run_params: dict = None,
+              segment_days: int = 28, fitted_rates = FITTED_RATES, bounds_factor: float = 10., rounds: int = 8,
+              candidates: int = 4096, elites: int = 64, finalists: int = 4, replicates: int = 20,
+              integrator: str = 'euler', weights = None, result_directory: str = 'calibration_results',
+              seed: int = None, workers: int = None, share_graph: bool = True, batch_size: int = 1024):
+
+    # observations are the arrays returned by DataExtractor.get_params for the fitted window, population the one of
+    # the country; the model runs on network_params['N'] nodes and is compared in fractions of the population
+    days = len(observations['Time'])
+    observed = np.array([np.asarray(observations[state.value], dtype=np.float64) for state in OBSERVED_STATES]) / population
+    model_population = network_params['N']
+    initial_infectious = max(1, int(round(observed[1][0] * model_population)))
+
+    starts, run_lengths = _segments(days, segment_days)
+    extracted = {name: np.clip(np.nan_to_num(np.asarray(observations[column], dtype=np.float64)), 0., None)
+                 for name, column in RATE_COLUMNS.items()}
+    fixed_rates = {name: values for name, values in extracted.items() if name not in fitted_rates}
+    prior = np.array([np.maximum(np.add.reduceat(extracted[name], starts) / run_lengths, MINIMUM_RATE)
+                      for name in fitted_rates])
+
+    dimension = prior.size
+    bound = np.log(bounds_factor)
+
+    os.makedirs(result_directory, exist_ok=True)
+    checkpoint_filename = os.path.join(result_directory, CHECKPOINT_FILENAME)
+    description = json.dumps([observed.tolist(), population, network_params, run_params, segment_days, list(fitted_rates),
+                              bounds_factor, candidates, elites, finalists, replicates, integrator, weights, seed],
+                             sort_keys=True, default=str)
+    key = hashlib.sha256(description.encode()).hexdigest()
+
+    checkpoint = {'version': CHECKPOINT_VERSION, 'key': key, 'round': 0, 'mean': [0.] * dimension,
+                  'spread': [bound] * dimension, 'candidates': []}
+    if os.path.exists(checkpoint_filename):
+        with open(checkpoint_filename, 'r') as f:
+            saved = json.load(f)
+        if saved.get('version') == CHECKPOINT_VERSION and saved.get('key') == key:
+            checkpoint = saved
+            print(f"Resuming calibration from round {checkpoint['round']}")
+        else:
+            print(f"Warning: {checkpoint_filename} belongs to another calibration, starting again")
+
+    # Screening: the first round samples the whole box, every later one a normal around the elites of the previous,
+    # whose spread shrinks as they agree. Each round has its own seed, so a resumed calibration draws the same samples,
+    # and all the finalists share the seeds of their ensembles, so their losses differ by the rates and not the noise
+    surrogate_args = (prior, fixed_rates, fitted_rates, run_lengths, observed, model_population, initial_infectious,
+                      integrator, weights)
+    seed_sequence = np.random.SeedSequence(seed)
+    round_seeds = seed_sequence.spawn(rounds)
+    ensemble_seed = int(seed_sequence.generate_state(1)[0])
+    while checkpoint['round'] < rounds:
+        rng = np.random.default_rng(round_seeds[checkpoint['round']])
+        mean = np.array(checkpoint['mean'])
+        if checkpoint['round'] == 0:
+            x = rng.uniform(-bound, bound, (candidates, dimension))
+            x[0] = 0.
+        else:
+            x = np.clip(rng.normal(mean, checkpoint['spread'], (candidates, dimension)), -bound, bound)
+            x[0] = mean
+
+        losses = np.concatenate([_surrogate_losses(x[i:i + batch_size], *surrogate_args)
+                                 for i in range(0, candidates, batch_size)])
+        losses = np.where(np.isfinite(losses), losses, np.inf)
+
+        order = np.argsort(losses)
+        elite = x[order[:elites]]
+        checkpoint['mean'] = elite.mean(axis=0).tolist()
+        checkpoint['spread'] = np.maximum(elite.std(axis=0), 1e-3).tolist()
+
+        best = checkpoint['candidates'] + [{'x': x[i].tolist(), 'surrogate_loss': float(losses[i])} for i in order[:finalists]]
+        checkpoint['candidates'] = sorted(best, key=lambda candidate: candidate['surrogate_loss'])[:finalists]
+        checkpoint['round'] += 1
+        _save_checkpoint(checkpoint_filename, checkpoint)
+
+        print(f"Screening round {checkpoint['round']}/{rounds}: best surrogate loss {checkpoint['candidates'][0]['surrogate_loss']:.6g}")
+
+    # Refinement: every finalist runs as a network ensemble, whose mean curves replace the surrogate in the loss. The
+    # results are kept with the candidate, so a finalist that stays one after more rounds is not run again
+    run_params = dict(run_params or {})
+    for index, candidate in enumerate(checkpoint['candidates']):
+        if 'network_loss' in candidate:
+            continue
+
+        schedules = _rate_schedules(candidate['x'], *surrogate_args[:4])
+        model_params = dict(network_params)
+        model_params.update({name + '_schedule': schedule[:, 0].tolist() for name, schedule in schedules.items()})
+
+        candidate_key = hashlib.sha256(json.dumps(candidate['x']).encode()).hexdigest()
+        result_filename = os.path.join(result_directory, f"finalist_{candidate_key[:16]}.json")
+        results = run_ensemble(SIRVD_NetworkVariableParameters, model_params, replicates, initial_infectious, days - 1,
+                               result_filename, seed=ensemble_seed, workers=workers,
+                               share_graph=share_graph, **run_params)
+
+        simulated = np.array([results['observables'][state.value]['mean'] for state in OBSERVED_STATES]) / model_population
+        candidate['network_loss'] = float(calibration_loss(simulated, observed, weights))
+        candidate['result_file'] = result_filename
+        _save_checkpoint(checkpoint_filename, checkpoint)
+
+        print(f"Finalist {index + 1}/{len(checkpoint['candidates'])}: network loss {candidate['network_loss']:.6g}")
+
+    best = min(checkpoint['candidates'], key=lambda candidate: candidate['network_loss'])
+    schedules = _rate_schedules(best['x'], *surrogate_args[:4])
+    checkpoint['best'] = {'network_loss': best['network_loss'], 'surrogate_loss': best['surrogate_loss'],
+                          'result_file': best['result_file'],
+                          'rates': {name: schedule[:, 0].tolist() for name, schedule in schedules.items()}}
+    _save_checkpoint(checkpoint_filename, checkpoint)
+
+    print(f"Calibration Terminated: network loss {checkpoint['best']['network_loss']:.6g}")
+
+    return checkpoint['best']
@@ -1,4 +1,6 @@
+import numpy as np
 from sirvd_base import SIRVD_Base, State
+from sirvd_schedule import RunLengthSchedule
 
 '''This module implements the compartmental version of the SIRVD model.'''
 class SIRVD_CompartmentalModel(SIRVD_Base):
@@ -18,14 +20,15 @@ class SIRVD_CompartmentalModel(SIRVD_Base):
         self.vaccinated = 0
 
 
-    def _record_state(self):
-        
-        self.observables[State.SUSCEPTIBLE].append(self.susceptibles)
-        self.observables[State.INFECTED].append(self.infected)
-        self.observables[State.RECOVERED].append(self.recovered)
-        self.observables[State.VACCINATED].append(self.vaccinated)
-        self.observables[State.DEAD].append(self.deceased)
-        self.observables['Time'].append(self.time)    
+    @property
+    def counts(self):
+
+        return {State.SUSCEPTIBLE: self.susceptibles, State.INFECTED: self.infected, State.RECOVERED: self.recovered,
+                State.VACCINATED: self.vaccinated, State.DEAD: self.deceased}
+
+
+    def _count_dtype(self):
+        return np.float64
 
 
     def _evolve(self, lockdowns = None, events = None):
@@ -43,7 +46,7 @@ class SIRVD_CompartmentalModel(SIRVD_Base):
         V_future = (((self.nu * self.susceptibles) * self.delta_t)) + self.vaccinated
         D_future = (((self.psi * self.infected) * self.delta_t)) + self.deceased
 
-        self.daily_new_inftected[self.time] += self.beta * self.susceptibles * self.infected / N_total
+        self.daily_new_inftected[self.row] += self.beta * self.susceptibles * self.infected / N_total
 
         self.susceptibles = S_future
         self.infected = I_future
@@ -54,23 +57,14 @@ class SIRVD_CompartmentalModel(SIRVD_Base):
     
     def _get_simulation_parameters(self):
 
-        info = {
-            'infection_rate': [],
-            'recovery_rate' : [],
-            'fatality_rate' : [],
-            'vaccination_rate' : [],
-            'breakthrough_rate': []
+        return {
+            'infection_rate': RunLengthSchedule.constant(self.beta, self.time).to_dict(),
+            'recovery_rate' : RunLengthSchedule.constant(self.mu, self.time).to_dict(),
+            'fatality_rate' : RunLengthSchedule.constant(self.psi, self.time).to_dict(),
+            'vaccination_rate' : RunLengthSchedule.constant(self.nu, self.time).to_dict(),
+            'breakthrough_rate': RunLengthSchedule.constant(self.sigma, self.time).to_dict()
         }
 
-        for t in range(self.time):
-            info['infection_rate'].append(self.beta)
-            info['recovery_rate'].append(self.mu)
-            info['fatality_rate'].append(self.psi)
-            info['vaccination_rate'].append(self.nu)
-            info['breakthrough_rate'].append(self.sigma)
-        
-        return info
-
     
     def _initialize_infection(self, number_of_infectious, target_higher, target_lower):
 
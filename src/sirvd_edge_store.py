@@ -0,0 +1,200 @@
+import numpy as np
+import scipy.sparse as sparse
+
+'''This module implements the edge containers of the network model. An EdgeArray keeps undirected edges in NumPy
+   arrays together with an activation mask: every bit of the mask is owned by one intervention, and an edge is active
+   only while no bit is set, so interventions that overlap in time compose and each one is started or ended by a
+   vectorised mask flip. An EdgeStore additionally maps every edge to its slot, so membership tests, insertions,
+   removals (by moving the last edge into the freed slot) and uniform random sampling all take constant time.'''
+def csr_adjacency(sources, targets, N: int, dtype=np.float64):
+
+    # Symmetric adjacency matrix of undirected edges, with both directions of every edge
+    return sparse.coo_array((np.ones(2 * len(sources), dtype=dtype), (np.concatenate((sources, targets)),
+                            np.concatenate((targets, sources)))), shape=(N, N)).tocsr()
+
+
+class EdgeArray:
+    def __init__(self, sources, targets):
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        # Edges that already have the lower endpoint first are kept as they are, without a copy
+        if np.any(sources > targets):
+            sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+        self.sources = sources
+        self.targets = targets
+        self.__masks = None
+        self.size = len(self.sources)
+        self.inactive = 0
+        self.__sorted_keys = None
+
+
+    def __len__(self):
+        return self.size
+
+
+    # Only interventions and edge changes write the masks, so the edges of a static network never allocate them
+    @property
+    def masks(self):
+
+        if self.__masks is None:
+            self.__masks = np.zeros(len(self.sources), dtype=np.uint64)
+        return self.__masks
+
+
+    @masks.setter
+    def masks(self, masks):
+        self.__masks = masks
+
+
+    def active_count(self):
+        return self.size - self.inactive
+
+
+    def arrays(self):
+        return self.sources[:self.size], self.targets[:self.size]
+
+
+    def active_arrays(self):
+
+        if self.inactive == 0:
+            return self.arrays()
+        active = self.masks[:self.size] == 0
+        return self.sources[:self.size][active], self.targets[:self.size][active]
+
+
+    def active_slots(self):
+        return np.flatnonzero(self.masks[:self.size] == 0)
+
+
+    def keys(self, N: int):
+        return self.sources[:self.size] * N + self.targets[:self.size]
+
+
+    def contains(self, u, v, N: int):
+
+        # Binary search on the sorted edge keys; only used on arrays whose edges never change
+        if self.__sorted_keys is None:
+            self.__sorted_keys = np.sort(self.keys(N))
+        key = min(u, v) * N + max(u, v)
+        position = np.searchsorted(self.__sorted_keys, key)
+        return position < len(self.__sorted_keys) and self.__sorted_keys[position] == key
+
+
+    def disable(self, slots, bit: int):
+
+        slots = np.asarray(slots, dtype=np.int64)
+        bit = np.uint64(1 << bit)
+        newly_inactive = slots[self.masks[slots] == 0]
+        self.masks[slots] |= bit
+        self.inactive += len(newly_inactive)
+        return newly_inactive
+
+
+    def enable(self, bit: int):
+
+        bit = np.uint64(1 << bit)
+        slots = np.flatnonzero(self.masks[:self.size] & bit)
+        self.masks[slots] &= ~bit
+        newly_active = slots[self.masks[slots] == 0]
+        self.inactive -= len(newly_active)
+        return newly_active
+
+
+class AdjacencyLists:
+    # Neighbour lists read from a CSR adjacency, with the part of the networkx interface the node-by-node engines use;
+    # the arrays are used as they are, so a matrix in shared memory is not copied
+    def __init__(self, adjacency):
+        self.indptr = adjacency.indptr
+        self.indices = adjacency.indices
+
+
+    def degree(self, node: int):
+        return int(self.indptr[node + 1] - self.indptr[node])
+
+
+    def neighbors(self, node: int):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]].tolist()
+
+
+class EdgeStore(EdgeArray):
+    def __init__(self, sources=(), targets=()):
+        super().__init__(sources, targets)
+        self.index = None
+
+
+    @staticmethod
+    def key(u, v):
+        return (int(u), int(v)) if u < v else (int(v), int(u))
+
+
+    def __contains__(self, edge):
+        return self.key(*edge) in self.__get_index()
+
+
+    def __get_index(self):
+
+        # The index is only needed by dynamic networks, so it is built on first use
+        if self.index is None:
+            sources, targets = self.arrays()
+            self.index = {edge: slot for slot, edge in enumerate(zip(sources.tolist(), targets.tolist()))}
+        return self.index
+
+
+    def add(self, u, v):
+
+        edge = self.key(u, v)
+        index = self.__get_index()
+        if edge[0] == edge[1] or edge in index:
+            return False
+
+        if self.size == len(self.sources):
+            self.__grow()
+
+        self.sources[self.size], self.targets[self.size] = edge
+        self.masks[self.size] = 0
+        index[edge] = self.size
+        self.size += 1
+        return True
+
+
+    def remove(self, u, v):
+
+        index = self.__get_index()
+        slot = index.pop(self.key(u, v), None)
+        if slot is None:
+            return False
+
+        if self.masks[slot] != 0:
+            self.inactive -= 1
+
+        last = self.size - 1
+        if slot != last:
+            self.sources[slot] = self.sources[last]
+            self.targets[slot] = self.targets[last]
+            self.masks[slot] = self.masks[last]
+            index[(int(self.sources[slot]), int(self.targets[slot]))] = slot
+        self.size -= 1
+        return True
+
+
+    def sample_active(self, rng, count):
+
+        # Rejection sampling over the slots in batches, so only edges not disabled by an intervention are returned;
+        # repeated slots keep their first occurrence, so the edges are a uniform sample without replacement
+        slots = np.empty(0, dtype=np.int64)
+        while len(slots) < count:
+            candidates = np.concatenate((slots, rng.integers(self.size, size=2 * (count - len(slots)) + 16)))
+            candidates = candidates[self.masks[candidates] == 0]
+            _, first = np.unique(candidates, return_index=True)
+            slots = candidates[np.sort(first)][:count]
+
+        return list(zip(self.sources[slots].tolist(), self.targets[slots].tolist()))
+
+
+    def __grow(self):
+
+        capacity = max(2 * len(self.sources), 16)
+        self.sources = np.resize(self.sources, capacity)
+        self.targets = np.resize(self.targets, capacity)
+        self.masks = np.resize(self.masks, capacity)
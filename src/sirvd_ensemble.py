@@ -0,0 +1,220 @@
+import itertools
+import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from sirvd_base import State
+
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+ADDITIONAL_DATA = ('infected_peak', 'infected_peak_time', 'epidemy_duration', 'case_fatality_rate', 'attack_rate')
+
+'''This module runs Monte Carlo ensembles of a network SIRVD model: independently seeded replicates are executed on a
+   process pool and their observables are streamed into running mean, variance and quantile accumulators, so that
+   only the aggregated statistics are kept in memory and written to the result file.'''
+class P2Quantile:
+    # P-square algorithm (Jain and Chlamtac, 1985): estimates a quantile with five markers per element, without
+    # storing the observations. Every element of the arrays passed to add() is estimated independently.
+    def __init__(self, p: float, shape: tuple):
+        self.p = p
+        self.count = 0
+        self.heights = np.zeros((5,) + shape)
+        self.positions = np.broadcast_to(np.arange(1., 6.).reshape((5,) + (1,) * len(shape)), (5,) + shape).copy()
+        self.desired = np.broadcast_to(np.array([1., 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.]).reshape((5,) + (1,) * len(shape)),
+                                       (5,) + shape).copy()
+        self.increments = np.array([0., p / 2, p, (1 + p) / 2, 1.]).reshape((5,) + (1,) * len(shape))
+
+
+    def add(self, values):
+
+        if self.count < 5:
+            self.heights[self.count] = values
+            self.count += 1
+            if self.count == 5:
+                self.heights.sort(axis=0)
+            return
+
+        self.count += 1
+        heights = self.heights
+        positions = self.positions
+
+        heights[0] = np.minimum(heights[0], values)
+        heights[4] = np.maximum(heights[4], values)
+        cell = (values >= heights[1]).astype(int) + (values >= heights[2]) + (values >= heights[3])
+        markers = np.arange(5).reshape((5,) + (1,) * np.ndim(values))
+        positions += markers > cell
+        self.desired += self.increments
+
+        for i in range(1, 4):
+            difference = self.desired[i] - positions[i]
+            move = ((difference >= 1) & (positions[i + 1] - positions[i] > 1)) | \
+                   ((difference <= -1) & (positions[i - 1] - positions[i] < -1))
+            if not np.any(move):
+                continue
+
+            sign = np.where(difference >= 0, 1., -1.)
+            parabolic = heights[i] + sign / (positions[i + 1] - positions[i - 1]) * \
+                ((positions[i] - positions[i - 1] + sign) * (heights[i + 1] - heights[i]) / (positions[i + 1] - positions[i]) +
+                 (positions[i + 1] - positions[i] - sign) * (heights[i] - heights[i - 1]) / (positions[i] - positions[i - 1]))
+            neighbor_height = np.where(sign > 0, heights[i + 1], heights[i - 1])
+            neighbor_position = np.where(sign > 0, positions[i + 1], positions[i - 1])
+            linear = heights[i] + sign * (neighbor_height - heights[i]) / (neighbor_position - positions[i])
+            in_bounds = (heights[i - 1] < parabolic) & (parabolic < heights[i + 1])
+
+            heights[i] = np.where(move, np.where(in_bounds, parabolic, linear), heights[i])
+            positions[i] = np.where(move, positions[i] + sign, positions[i])
+
+
+    def value(self):
+
+        if self.count >= 5:
+            return self.heights[2].copy()
+        return np.quantile(self.heights[:self.count], self.p, axis=0)
+
+
+class RunningStatistics:
+    def __init__(self, shape: tuple, quantiles=DEFAULT_QUANTILES):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.squared_deviations = np.zeros(shape)
+        self.quantiles = {p: P2Quantile(p, shape) for p in quantiles}
+
+
+    def add(self, values):
+
+        # Welford's update of mean and variance
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.squared_deviations += delta * (values - self.mean)
+
+        for estimator in self.quantiles.values():
+            estimator.add(values)
+
+
+    def variance(self):
+
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self.squared_deviations / (self.count - 1)
+
+
+    def summary(self, z: float = 1.96):
+
+        std = np.sqrt(self.variance())
+        half_width = z * std / np.sqrt(max(self.count, 1))
+        return {
+            'mean': self.mean.tolist(),
+            'std': std.tolist(),
+            'ci_low': (self.mean - half_width).tolist(),
+            'ci_high': (self.mean + half_width).tolist(),
+            'quantiles': {str(p): estimator.value().tolist() for p, estimator in self.quantiles.items()}
+        }
+
+
+def _run_replicate(model_class, model_params: dict, seed: int, graph_seed: int, run_params: dict):
+
+    model = model_class(**model_params, seed=seed, graph_seed=graph_seed)
+    model.run_simulation(**run_params, result_filename=None, verbose=False)
+
+    observables = np.array([model.observables[state] for state in State], dtype=float)
+
+    steps = observables.shape[1]
+    reproduction_rate = np.zeros(steps)
+    reproduction_rate[:min(len(model.reproduction_rate), steps)] = model.reproduction_rate[:steps]
+
+    additional_data = [float(getattr(model, name)) for name in ADDITIONAL_DATA]
+
+    return (model.observables['Time'].tolist(), observables, np.array(model.daily_new_inftected, dtype=float),
+            reproduction_rate, np.array(additional_data), model._get_simulation_parameters())
+
+
+def run_ensemble(model_class, model_params: dict, replicates: int, initial_infectious: int, simulation_time: int,
+                 result_filename: str = 'ensemble_results.json', seed: int = None, workers: int = None,
+                 share_graph: bool = False, quantiles=DEFAULT_QUANTILES, lockdowns = None, events = None,
+                 target_higher = False, target_lower = False):
+
+    # Replicate seeds are spawned from one SeedSequence, so the ensemble is reproducible from its seed
+    seed_sequence = np.random.SeedSequence(seed)
+    replicate_seeds = [int(child.generate_state(1)[0]) for child in seed_sequence.spawn(replicates)]
+    graph_seed = int(seed_sequence.generate_state(1)[0]) if share_graph else None
+
+    run_params = {'initial_infectious': initial_infectious, 'simulation_time': simulation_time, 'lockdowns': lockdowns,
+                  'events': events, 'target_higher': target_higher, 'target_lower': target_lower}
+
+    # At most two replicates per worker are in flight, and each finished one is dropped once it is accumulated, so
+    # the results held in memory do not grow with the number of replicates
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending_seeds = iter(replicate_seeds)
+    pending = set()
+
+    statistics = None
+    completed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for replicate_seed in itertools.islice(pending_seeds, window - len(pending)):
+                pending.add(executor.submit(_run_replicate, model_class, model_params, replicate_seed, graph_seed,
+                                            run_params))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            future = done.pop()
+            pending |= done
+            time, observables, new_infected, reproduction_rate, additional_data, parameters = future.result()
+            del future
+
+            if statistics is None:
+                times = time
+                simulation_parameters = parameters
+                statistics = {
+                    'observables': RunningStatistics(observables.shape, quantiles),
+                    'new_infected': RunningStatistics(new_infected.shape, quantiles),
+                    'reproduction_rate': RunningStatistics(reproduction_rate.shape, quantiles),
+                    'additional_data': RunningStatistics(additional_data.shape, quantiles)
+                }
+
+            statistics['observables'].add(observables)
+            statistics['new_infected'].add(new_infected)
+            statistics['reproduction_rate'].add(reproduction_rate)
+            statistics['additional_data'].add(additional_data)
+
+            completed += 1
+            print(f"\rCompleted replicates: {completed}/{replicates}", end='')
+
+    print('\nEnsemble Terminated')
+
+    results = _aggregate_results(statistics, times, simulation_parameters, replicates, seed)
+
+    with open(result_filename, 'w') as f:
+        json.dump(results, f)
+
+    print(f"Ensemble result save in the file: {result_filename}")
+
+    return results
+
+
+def _select(summary: dict, index: int):
+    return {key: ({p: values[index] for p, values in value.items()} if key == 'quantiles' else value[index])
+            for key, value in summary.items()}
+
+
+def _aggregate_results(statistics: dict, times: list, simulation_parameters: dict, replicates: int, seed: int):
+
+    observables_summary = statistics['observables'].summary()
+    observables_result = {'Time': times}
+    for index, state in enumerate(State):
+        observables_result[state.value] = _select(observables_summary, index)
+
+    additional_summary = statistics['additional_data'].summary()
+    additional_result = {'reproduction_rate': statistics['reproduction_rate'].summary(),
+                         'new_infected': statistics['new_infected'].summary()}
+    for index, name in enumerate(ADDITIONAL_DATA):
+        additional_result[name] = _select(additional_summary, index)
+
+    return {
+        'observables': observables_result,
+        'additional_data': additional_result,
+        'parameters': simulation_parameters,
+        'ensemble': {'replicates': replicates, 'seed': seed}
+    }
@@ -0,0 +1,200 @@
+from sirvd_base import State, STATE_CODES
+from indexed_priority_queue import IndexedPriorityQueue
+from indexed_set import IndexedSet
+from sirvd_rng import BufferedStream
+
+SUSCEPTIBLE = STATE_CODES[State.SUSCEPTIBLE]
+INFECTED = STATE_CODES[State.INFECTED]
+RECOVERED = STATE_CODES[State.RECOVERED]
+VACCINATED = STATE_CODES[State.VACCINATED]
+DEAD = STATE_CODES[State.DEAD]
+AGGREGATE = -1
+
+'''This module implements an exact continuous-time engine for the network SIRVD model (next-reaction method). Every
+   susceptible with infected neighbours has a putative infection time in an indexed priority queue; when its hazard
+   changes the time is redrawn, which is exact because waiting times are memoryless. Vaccination, the end of the
+   infection and waning immunity have the same rate for every node in a state, so they are one aggregate channel in
+   the queue, whose rate follows the compartment totals and which picks a node of the state uniformly when it fires.
+   A change of the rates then only redraws the aggregate channel and, for the infection rate, the clocks of the
+   susceptibles at risk, so the cost of a run follows the number of events and not the population. The rates of an interval are the ones
+   the discrete engines would use for the step that ends it, so per-day observables keep the same meaning. Event
+   times come from one stream of the model's counter-based generator, so a run is reproducible from its seed, but in
+   continuous time it does not follow the trajectories of the discrete engines.'''
+class EventEngine:
+    def __init__(self, model):
+        self.model = model
+        self.rng = BufferedStream(model.random.stream(0, 'event_engine'))
+
+        self.states = [SUSCEPTIBLE] * model.population
+        self.members = {SUSCEPTIBLE: IndexedSet(range(model.population)), INFECTED: IndexedSet(),
+                        RECOVERED: IndexedSet()}
+        self.infected_neighbors = [0] * model.population
+        self.degree = [model.graph.degree(n) for n in range(model.population)]
+        self.counts = [0] * len(STATE_CODES)
+        self.counts[SUSCEPTIBLE] = model.population
+
+        self.queue = IndexedPriorityQueue()
+        self.now = 0.
+        self.rates = None
+        self.new_infected = 0
+
+
+    def infect(self, nodes):
+
+        for node in nodes:
+            self.__set_state(node, INFECTED)
+        self.__schedule_aggregate()
+
+
+    def count_states(self):
+        return {state: self.counts[code] for state, code in STATE_CODES.items()}
+
+
+    def step(self, infection_rate: float, vaccination_rate: float, fatality_rate: float,
+             recovery_rate: float, breakthrough_rate: float):
+
+        rates = (infection_rate, vaccination_rate, fatality_rate, recovery_rate, breakthrough_rate)
+        if rates != self.rates:
+            self.__set_rates(rates)
+
+        self.new_infected = 0
+        end_time = self.model.time
+        while len(self.queue) > 0 and self.queue.peek()[0] <= end_time:
+            self.now, node = self.queue.pop()
+            self.__fire(node)
+        self.now = end_time
+
+        return self.new_infected
+
+
+    def edges_added(self, sources, targets):
+        self.__change_edges(sources, targets, 1)
+
+
+    def edges_removed(self, sources, targets):
+        self.__change_edges(sources, targets, -1)
+
+
+    def __change_edges(self, sources, targets, change):
+
+        touched = set()
+        for u, v in zip(sources.tolist(), targets.tolist()):
+            self.degree[u] += change
+            self.degree[v] += change
+            if self.states[u] == INFECTED:
+                self.infected_neighbors[v] += change
+            if self.states[v] == INFECTED:
+                self.infected_neighbors[u] += change
+            touched.add(u)
+            touched.add(v)
+
+        # Each endpoint is rescheduled once, after all its hazard changes
+        for node in touched:
+            self.__reschedule(node)
+
+
+    def __set_rates(self, rates):
+
+        old_rates = self.rates
+        self.rates = rates
+
+        # Only the infection clocks depend on the rates node by node; at the first rates the susceptibles at risk
+        # have no clock yet
+        if old_rates is None:
+            for node, state in enumerate(self.states):
+                if state == SUSCEPTIBLE and self.infected_neighbors[node] > 0:
+                    self.__schedule(node)
+        elif rates[0] != old_rates[0]:
+            for node in [key for key in self.queue.keys if key != AGGREGATE]:
+                self.__schedule(node)
+
+        self.__schedule_aggregate()
+
+
+    def __infection_hazard(self, node):
+
+        if self.degree[node] == 0:
+            return 0.
+        return self.rates[0] * self.infected_neighbors[node] / self.degree[node]
+
+
+    # Rates of the aggregate channel: vaccination of the susceptibles, end of the infection and waning immunity
+    def __aggregate_rates(self):
+
+        return (self.rates[1] * self.counts[SUSCEPTIBLE], (self.rates[2] + self.rates[3]) * self.counts[INFECTED],
+                self.rates[4] * self.counts[RECOVERED])
+
+
+    def __schedule(self, node):
+
+        hazard = self.__infection_hazard(node) if self.states[node] == SUSCEPTIBLE else 0.
+        if hazard > 0:
+            self.queue.push(node, self.now + self.rng.expovariate(hazard))
+        else:
+            self.queue.remove(node)
+
+
+    def __schedule_aggregate(self):
+
+        if self.rates is None:
+            return
+        rate = sum(self.__aggregate_rates())
+        if rate > 0:
+            self.queue.push(AGGREGATE, self.now + self.rng.expovariate(rate))
+        else:
+            self.queue.remove(AGGREGATE)
+
+
+    def __reschedule(self, node):
+
+        if self.rates is not None:
+            self.__schedule(node)
+
+
+    def __fire(self, key):
+
+        if key != AGGREGATE:
+            self.__set_state(key, INFECTED)
+            self.new_infected += 1
+        else:
+            vaccination, removal, waning = self.__aggregate_rates()
+            random_number = self.rng.random() * (vaccination + removal + waning)
+
+            if random_number < vaccination:
+                self.__set_state(self.members[SUSCEPTIBLE].choice(self.rng), VACCINATED)
+            elif random_number - vaccination < removal:
+                node = self.members[INFECTED].choice(self.rng)
+                if random_number - vaccination < self.rates[2] * self.counts[INFECTED]:
+                    self.__set_state(node, DEAD)
+                else:
+                    self.__set_state(node, RECOVERED)
+            else:
+                self.__set_state(self.members[RECOVERED].choice(self.rng), SUSCEPTIBLE)
+
+        # Every event changes the compartment totals, so the aggregate channel is redrawn
+        self.__schedule_aggregate()
+
+
+    def __set_state(self, node, state):
+
+        old_state = self.states[node]
+        if old_state == state:
+            return
+
+        self.states[node] = state
+        self.counts[old_state] -= 1
+        self.counts[state] += 1
+        if old_state in self.members:
+            self.members[old_state].discard(node)
+        if state in self.members:
+            self.members[state].add(node)
+
+        # Only susceptibles have a clock of their own
+        if old_state == SUSCEPTIBLE or state == SUSCEPTIBLE:
+            self.__reschedule(node)
+
+        if old_state == INFECTED or state == INFECTED:
+            change = 1 if state == INFECTED else -1
+            for neighbor in self.model.graph.neighbors(node):
+                self.infected_neighbors[neighbor] += change
+                self.__reschedule(neighbor)
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from sirvd_graph_generators import generate_edges
+
+# Part of the key, so that entries written in an older layout are never read as the current one
+CACHE_FORMAT = 2
+
+'''This module implements an on-disk cache of generated networks, keyed by graph type, parameters, size and seed. Each
+   network is stored as its edge list, every undirected edge once with the lower-numbered endpoint first, sorted and
+   in the int64 arrays the edge store keeps. The arrays are plain .npy files, so they load as read-only memory maps
+   that the models use without a copy, and a new entry is written to a temporary directory and renamed into place, so
+   concurrent workers never see a partial file.'''
+class GraphCache:
+    def __init__(self, directory: str = 'graph_cache'):
+        self.directory = directory
+
+
+    @staticmethod
+    def key(graph_type: str, graph_params: dict, N: int, seed: int):
+
+        description = json.dumps([graph_type, graph_params or dict(), N, seed, CACHE_FORMAT], sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+
+    def get_edges(self, graph_type: str, graph_params: dict, N: int, seed: int):
+
+        key = self.key(graph_type, graph_params, N, seed)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+
+        sources, targets = generate_edges(graph_type, N, graph_params, seed)
+        # The stored copy is returned even the first time, so every run on the network sees its edges in the same order
+        self.save(key, sources, targets, N, {'graph_type': graph_type, 'graph_params': graph_params, 'N': N, 'seed': seed})
+        return self.load(key)
+
+
+    def load(self, key: str):
+
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+
+        return (np.load(os.path.join(path, 'sources.npy'), mmap_mode='r'),
+                np.load(os.path.join(path, 'targets.npy'), mmap_mode='r'))
+
+
+    def save(self, key: str, sources, targets, N: int, metadata: dict):
+
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+        order = np.lexsort((targets, sources))
+
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=self.directory)
+        np.save(os.path.join(temporary, 'sources.npy'), sources[order])
+        np.save(os.path.join(temporary, 'targets.npy'), targets[order])
+        with open(os.path.join(temporary, 'graph.json'), 'w') as f:
+            json.dump(metadata, f)
+
+        try:
+            os.rename(temporary, os.path.join(self.directory, key))
+        except OSError:
+            # Another process stored the same network first
+            for name in os.listdir(temporary):
+                os.remove(os.path.join(temporary, name))
+            os.rmdir(temporary)
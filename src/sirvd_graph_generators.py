@@ -0,0 +1,199 @@
+import numpy as np
+from scipy.sparse import coo_array
+from scipy.sparse.csgraph import connected_components
+
+MAX_CONNECTION_TRIES = 100
+
+'''This module generates the random networks of the network SIRVD model directly as edge arrays, in time linear in the
+   number of nodes and edges. Every generator returns two int64 arrays (sources, targets) with source < target, each
+   undirected edge listed once and no self-loops. Bernoulli graphs skip over the absent pairs with geometric jumps, the
+   preferential attachment graph uses the edge-list copying scheme of Batagelj and Brandes, and the small-world graph
+   rewires a ring lattice in bulk.'''
+def generate_edges(graph_type: str, N: int, graph_params: dict, seed: int):
+
+    rng = np.random.default_rng(seed)
+    graph_params = graph_params or dict()
+
+    if graph_type == 'erdos_renyi':
+        return erdos_renyi_edges(N, graph_params.get('p', 0.1), rng)
+    elif graph_type == 'barabasi_albert':
+        return barabasi_albert_edges(N, graph_params.get('m', 3), rng)
+    elif graph_type == 'watts_strogatz':
+        return watts_strogatz_edges(N, graph_params.get('k', 4), graph_params.get('p', 0.1), rng)
+    elif graph_type == 'stochastic_block_model':
+        sizes = graph_params.get('sizes', [N/4, N/4, N/4, N/4])
+        p_matrix = graph_params.get('p_matrix', [[0.5, 0.25, 0.25, 0.25], [0.25, 0.5, 0.25, 0.25],
+                                                 [0.25, 0.25, 0.5, 0.25], [0.25, 0.25, 0.25, 0.5]])
+
+        if np.sum(sizes) != N:
+            print('Parameter error for stochastic block model - sizes do not much population')
+            exit()
+
+        for row in p_matrix:
+            for elem in row:
+                if elem < 0 or elem > 1:
+                    print('Parameter error for stochastic block model - probabilities must be between 0 and 1')
+                    exit()
+
+        return stochastic_block_model_edges([int(size) for size in sizes], p_matrix, rng)
+
+    print("Unsupported graph type")
+    exit()
+
+
+def _bernoulli_indices(pairs: int, p: float, rng):
+
+    # Indices in [0, pairs) each kept with probability p, found by summing geometric gaps between kept indices
+    if p <= 0 or pairs <= 0:
+        return np.empty(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(pairs, dtype=np.int64)
+
+    chunks = []
+    last = -1
+    while True:
+        expected = (pairs - last) * p
+        gaps = rng.geometric(p, size=int(expected + 4 * np.sqrt(expected)) + 16)
+        indices = last + np.cumsum(gaps)
+        chunks.append(indices[indices < pairs])
+        if indices[-1] >= pairs:
+            break
+        last = indices[-1]
+
+    return np.concatenate(chunks)
+
+
+def _triangle_pairs(indices):
+
+    # Maps k to the k-th pair (u, v), u < v, in the order (0,1), (0,2), (1,2), (0,3), ...
+    targets = ((1 + np.sqrt(1 + 8 * indices.astype(np.float64))) / 2).astype(np.int64)
+    sources = indices - targets * (targets - 1) // 2
+    # Rounding of the square root can be off by one for very large indices
+    too_far = sources < 0
+    targets[too_far] -= 1
+    sources = indices - targets * (targets - 1) // 2
+    too_near = sources >= targets
+    targets[too_near] += 1
+    sources = indices - targets * (targets - 1) // 2
+    return sources, targets
+
+
+def erdos_renyi_edges(N: int, p: float, rng):
+    return _triangle_pairs(_bernoulli_indices(N * (N - 1) // 2, p, rng))
+
+
+def stochastic_block_model_edges(sizes: list, p_matrix: list, rng):
+
+    offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+    sources, targets = [], []
+
+    for i in range(len(sizes)):
+        for j in range(i, len(sizes)):
+            if i == j:
+                block_sources, block_targets = _triangle_pairs(_bernoulli_indices(sizes[i] * (sizes[i] - 1) // 2,
+                                                                                   p_matrix[i][i], rng))
+            else:
+                indices = _bernoulli_indices(sizes[i] * sizes[j], p_matrix[i][j], rng)
+                block_sources, block_targets = indices // sizes[j], indices % sizes[j]
+            sources.append(block_sources + offsets[i])
+            targets.append(block_targets + offsets[j])
+
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def barabasi_albert_edges(N: int, m: int, rng):
+
+    if m < 1 or m >= N:
+        print('Parameter error for barabasi albert model - m must be between 1 and N - 1')
+        exit()
+
+    # The network starts from a star on nodes 0..m; node v > m then adds m edges whose targets are copied from
+    # uniformly chosen endpoint slots of the earlier edges, which is attachment proportional to degree
+    initial_edges = m
+    new_nodes = N - m - 1
+    total_edges = initial_edges + new_nodes * m
+
+    endpoints = np.empty(2 * total_edges, dtype=np.int64)
+    endpoints[0:2 * initial_edges:2] = 0
+    endpoints[1:2 * initial_edges:2] = np.arange(1, m + 1)
+    endpoints[2 * initial_edges::2] = np.repeat(np.arange(m + 1, N), m)
+
+    # Slots before the first edge of the node that owns each new edge, which are the ones it can copy from
+    first_edge = initial_edges + np.repeat(np.arange(new_nodes), m) * m
+    target_slots = 2 * np.arange(initial_edges, total_edges) + 1
+
+    copied = (rng.random(len(target_slots)) * (2 * first_edge)).astype(np.int64)
+
+    while True:
+        # Pointer jumping: a copied slot may itself be a copied target, so every chain is followed by repeated
+        # squaring over the still unresolved slots only
+        resolved = copied.copy()
+        pending = np.flatnonzero((resolved >= 2 * initial_edges) & (resolved % 2 == 1))
+        while len(pending) > 0:
+            resolved[pending] = resolved[(resolved[pending] - 1) // 2 - initial_edges]
+            pending = pending[(resolved[pending] >= 2 * initial_edges) & (resolved[pending] % 2 == 1)]
+        endpoints[target_slots] = endpoints[resolved]
+
+        # The m targets of a node must be distinct: later duplicates draw again until none is left
+        targets = endpoints[target_slots].reshape(new_nodes, m)
+        duplicates = np.zeros(targets.shape, dtype=bool)
+        for later in range(1, m):
+            for earlier in range(later):
+                duplicates[:, later] |= targets[:, later] == targets[:, earlier]
+        redraw = duplicates.ravel()
+        if not np.any(redraw):
+            break
+
+        copied[redraw] = (rng.random(np.count_nonzero(redraw)) * (2 * first_edge[redraw])).astype(np.int64)
+
+    sources, targets = endpoints[0::2], endpoints[1::2]
+    return np.minimum(sources, targets), np.maximum(sources, targets)
+
+
+def watts_strogatz_edges(N: int, k: int, p: float, rng):
+
+    if k >= N:
+        print('Parameter error for watts strogatz model - k must be smaller than N')
+        exit()
+
+    half = k // 2
+    for _ in range(MAX_CONNECTION_TRIES):
+        sources, targets = _rewired_ring(N, half, p, rng)
+        adjacency = coo_array((np.ones(len(sources)), (sources, targets)), shape=(N, N))
+        if connected_components(adjacency, directed=False, return_labels=False) == 1:
+            return np.minimum(sources, targets), np.maximum(sources, targets)
+
+    print('Error: maximum number of tries exceeded for a connected watts strogatz graph')
+    exit()
+
+
+def _rewired_ring(N: int, half: int, p: float, rng):
+
+    # Ring lattice: every node is joined to its next half neighbours; each edge then moves its far end to a uniformly
+    # chosen node with probability p, and moves that would create a self-loop or a duplicate edge are drawn again
+    sources = np.repeat(np.arange(N, dtype=np.int64), half)
+    targets = (sources + np.tile(np.arange(1, half + 1), N)) % N
+    keys = np.minimum(sources, targets) * N + np.maximum(sources, targets)
+
+    rewire = np.flatnonzero(rng.random(len(sources)) < p)
+    while len(rewire) > 0:
+        new_targets = rng.integers(N, size=len(rewire))
+        new_keys = np.minimum(sources[rewire], new_targets) * N + np.maximum(sources[rewire], new_targets)
+
+        # A move is accepted if it does not hit its own source, an edge of the graph or another move of the batch
+        sorted_keys = np.sort(keys)
+        positions = np.minimum(np.searchsorted(sorted_keys, new_keys), len(sorted_keys) - 1)
+        _, first = np.unique(new_keys, return_index=True)
+        unique_move = np.zeros(len(rewire), dtype=bool)
+        unique_move[first] = True
+        accepted = (new_targets != sources[rewire]) & unique_move & (sorted_keys[positions] != new_keys)
+
+        targets[rewire[accepted]] = new_targets[accepted]
+        keys[rewire[accepted]] = new_keys[accepted]
+        rewire = rewire[~accepted]
+
+        # Nodes connected to everyone else cannot rewire, as in the sequential algorithm
+        degree = np.bincount(np.concatenate((sources, targets)), minlength=N)
+        rewire = rewire[degree[sources[rewire]] < N - 1]
+
+    return sources, targets
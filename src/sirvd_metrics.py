@@ -0,0 +1,110 @@
+import numpy as np
+
+DEFAULT_INFECTED_THRESHOLD = 0.01
+
+'''This module computes the summary metrics of an epidemic: the reproduction rate at every step until the infection
+   dies out, the infected peak and its time, the epidemic duration, the case fatality rate, the attack rate and the
+   time at which the infected first reach a fraction of the population. EpidemicMetrics updates them online, one
+   recorded step at a time and with constant memory for every scalar metric; compute_metrics gets the same values from
+   stored arrays in one vectorized pass, also over many replicates at once.'''
+class EpidemicMetrics:
+    def __init__(self, population: int, delta_t = 1, infected_threshold: float = DEFAULT_INFECTED_THRESHOLD):
+        self.population = population
+        self.delta_t = delta_t
+        self.threshold = infected_threshold * population
+
+        self.steps = 0
+        self.reproduction_rate = [0]
+        self.infected_peak = None
+        self.infected_peak_time = None
+        self.epidemy_duration = None
+        self.time_to_threshold = -1
+        self.total_infected = 0
+        self.previous_infected = None
+        self.last_time = None
+        self.last_dead = 0
+
+
+    # Called once per recorded step with the step's time, compartment totals and new infections
+    def update(self, time, infected, dead, new_infected):
+
+        self.total_infected += new_infected
+
+        if self.steps == 0 or infected > self.infected_peak:
+            self.infected_peak = infected
+            self.infected_peak_time = time
+
+        # The epidemic ends at the first step after the start without infected; the reproduction rate is kept until then
+        if self.steps > 0 and self.epidemy_duration is None:
+            if infected < 1:
+                self.epidemy_duration = time
+            else:
+                self.reproduction_rate.append(abs(new_infected) / self.previous_infected)
+
+        if self.time_to_threshold == -1 and infected >= self.threshold:
+            self.time_to_threshold = time
+
+        self.previous_infected = infected
+        self.last_time = time
+        self.last_dead = dead
+        self.steps += 1
+
+
+    def result(self):
+
+        epidemy_duration = self.epidemy_duration
+        if epidemy_duration is None:
+            epidemy_duration = self.last_time + self.delta_t if self.steps > 0 else 0
+
+        return {
+            'reproduction_rate': self.reproduction_rate,
+            'infected_peak_time': self.infected_peak_time,
+            'infected_peak': self.infected_peak,
+            'epidemy_duration': epidemy_duration,
+            'case_fatality_rate': self.last_dead / self.total_infected if self.total_infected != 0 else 0.,
+            'attack_rate': self.total_infected / self.population,
+            'time_to_threshold': self.time_to_threshold
+        }
+
+
+def compute_metrics(times, infected, dead, new_infected, population: int, delta_t = 1,
+                    infected_threshold: float = DEFAULT_INFECTED_THRESHOLD):
+
+    # Steps are along the first axis and any further axis holds replicates. The reproduction rate keeps all the steps,
+    # with zeros from the end of the epidemic on, so that replicates of different duration share one array
+    times = np.asarray(times)
+    infected = np.asarray(infected)
+    dead = np.asarray(dead)
+    new_infected = np.asarray(new_infected)
+    steps = len(times)
+    step_shape = (steps,) + (1,) * (infected.ndim - 1)
+
+    peak_index = np.argmax(infected, axis=0)
+    infected_peak = np.take_along_axis(infected, peak_index[None], axis=0)[0]
+
+    below = infected[1:] < 1
+    ended = np.any(below, axis=0)
+    end_index = np.where(ended, np.argmax(below, axis=0) + 1, steps)
+    epidemy_duration = np.where(ended, times[np.minimum(end_index, steps - 1)], times[-1] + delta_t)
+
+    reproduction_rate = np.zeros(infected.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reproduction_rate[1:] = np.abs(new_infected[1:]) / infected[:-1]
+    reproduction_rate[np.arange(steps).reshape(step_shape) >= end_index] = 0.
+
+    total_infected = np.sum(new_infected, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        case_fatality_rate = np.where(total_infected != 0, dead[-1] / np.where(total_infected != 0, total_infected, 1), 0.)
+
+    reached = infected >= infected_threshold * population
+    time_to_threshold = np.where(np.any(reached, axis=0), times[np.argmax(reached, axis=0)], -1)
+
+    return {
+        'reproduction_rate': reproduction_rate,
+        'infected_peak_time': times[peak_index],
+        'infected_peak': infected_peak,
+        'epidemy_duration': epidemy_duration,
+        'case_fatality_rate': case_fatality_rate,
+        'attack_rate': total_infected / population,
+        'time_to_threshold': time_to_threshold
+    }
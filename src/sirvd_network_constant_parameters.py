@@ -1,11 +1,15 @@
 from sirvd_network_model import SIRVD_NetworkModel
+from sirvd_schedule import RunLengthSchedule
 
 '''This module implements the SIRVD model on a network using constant parameters.'''
 class SIRVD_NetworkConstantParameters(SIRVD_NetworkModel):
     def __init__(self, N: int, infection_rate: float, recovery_rate: float, fatality_rate: float, 
                  vaccination_rate: float, breakthrough_rate: float, graph_type: str, graph_params: dict = dict(), 
-                 delta_t: int = 1, is_dynamic: bool = False):
-        super().__init__(N, graph_type, graph_params, delta_t, is_dynamic)
+                 delta_t: int = 1, is_dynamic: bool = False, engine: str = 'agent',
+                 seed: int = None, graph_seed: int = None, graph_cache: str = None,
+                 extinction: str = 'sample', shared_graph = None, workers: int = None, replicate: int = 0):
+        super().__init__(N, graph_type, graph_params, delta_t, is_dynamic, engine, seed, graph_seed, graph_cache, extinction,
+                         shared_graph, workers, replicate)
         self.infection_rate = infection_rate
         self.vaccination_rate = vaccination_rate
         self.recovery_rate = recovery_rate
@@ -13,24 +17,17 @@ class SIRVD_NetworkConstantParameters(SIRVD_NetworkModel):
         self.breakthrough_rate = breakthrough_rate
 
 
-    def _evolve_node(self, node_id: int):
-        self._evolve_node_state(node_id, self.infection_rate, self.vaccination_rate, self.fatality_rate, self.recovery_rate, self.breakthrough_rate)
+    def _get_rates(self, time):
+        return self.infection_rate, self.vaccination_rate, self.fatality_rate, self.recovery_rate, self.breakthrough_rate
         
 
     def _get_simulation_parameters(self):
-        info = {
-            'infection_rate': [],
-            'recovery_rate' : [],
-            'fatality_rate' : [],
-            'vaccination_rate' : [],
-            'breakthrough_rate': []
-        }
 
-        for t in range(self.time):
-            info['infection_rate'].append(self.infection_rate)
-            info['recovery_rate'].append(self.recovery_rate)
-            info['fatality_rate'].append(self.fatality_rate)
-            info['vaccination_rate'].append(self.vaccination_rate)
-            info['breakthrough_rate'].append(self.breakthrough_rate)
-        
-        return info
\ No newline at end of file
+        # Constant rates are written as a single run covering the simulated time
+        return {
+            'infection_rate': RunLengthSchedule.constant(self.infection_rate, self.time).to_dict(),
+            'recovery_rate' : RunLengthSchedule.constant(self.recovery_rate, self.time).to_dict(),
+            'fatality_rate' : RunLengthSchedule.constant(self.fatality_rate, self.time).to_dict(),
+            'vaccination_rate' : RunLengthSchedule.constant(self.vaccination_rate, self.time).to_dict(),
+            'breakthrough_rate': RunLengthSchedule.constant(self.breakthrough_rate, self.time).to_dict()
+        }
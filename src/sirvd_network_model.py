@@ -1,8 +1,17 @@
 import networkx as nx
 import numpy as np
-import random
+import math
+import heapq
 from abc import abstractmethod
 from sirvd_base import SIRVD_Base, State
+from indexed_set import IndexedSet
+from sirvd_edge_store import AdjacencyLists, EdgeArray, EdgeStore, csr_adjacency
+from sirvd_graph_generators import generate_edges
+from sirvd_graph_cache import GraphCache
+from sirvd_vectorized_engine import VectorizedEngine, vaccination_hazard, vaccination_thresholds
+from sirvd_event_engine import EventEngine
+from sirvd_partitioned_engine import PartitionedEngine
+from sirvd_rng import CounterRNG
 
 '''This module implements the basic structure for a SIRVD model simulation through a network approach.'''
 class Person:
@@ -13,212 +22,515 @@ class Person:
 
 
 class SIRVD_NetworkModel(SIRVD_Base):
-    def __init__(self, N:int, graph_type: str, graph_params: dict = None, delta_t: int = 1, is_dynamic: bool = False):
+    def __init__(self, N:int, graph_type: str, graph_params: dict = None, delta_t: int = 1, is_dynamic: bool = False,
+                 engine: str = 'agent', seed: int = None, graph_seed: int = None, graph_cache: str = None,
+                 extinction: str = 'sample', shared_graph = None, workers: int = None, replicate: int = 0):
         super().__init__(N, delta_t)
         self.graph_type = graph_type
+        self.graph_params = graph_params or dict()
         self.is_dynamic = is_dynamic
+        self.engine_type = engine
 
-        self.__create_graph(self.population, graph_params)
-
-        self.people = {n: Person(n) for n in self.graph.nodes}
-
+        # Once no one is infected the network plays no role anymore: 'sample' draws the remaining vaccinations and
+        # waning immunity in bulk from the compartment totals, 'expected' follows their expected values and
+        # 'simulate' keeps stepping every node
+        if extinction not in ('simulate', 'sample', 'expected'):
+            print("Unsupported extinction mode")
+            exit()
+        self.extinction = extinction
+        self.__extinct_counts = None
+
+        # The graph and the dynamics get independent seeds derived from the same one; without a seed both are random.
+        # Every draw of the dynamics is keyed by its step, node and purpose, so all the engines, however they visit
+        # or split the nodes, follow the same trajectory for the same seed and replicate
+        derived_seeds = np.random.SeedSequence(seed).generate_state(4)
+        self.graph_seed = int(derived_seeds[0]) if graph_seed is None else graph_seed
+        self.dynamics_seed = int(derived_seeds[1])
+        self.replicate = replicate
+        self.random = CounterRNG(self.dynamics_seed, replicate)
+
+        self.__shared_graph = shared_graph
+        self.__create_graph(self.population, graph_params, graph_cache, seed is not None or graph_seed is not None)
+
+        # Each running event adds an overlay of edges on top of the base network, keyed by its index in the events list
+        self.__event_layers = dict()
+
+        self.engine = None
+        self.__frontier = None
+        if self.engine_type in ('agent', 'frontier'):
+            self.people = {n: Person(n) for n in range(self.population)}
+            self.infected_neighbors = [0] * self.population
+            self.__changed_nodes = list()
+            self.__counts = {state: 0 for state in State}
+            self.__counts[State.SUSCEPTIBLE] = len(self.people)
+
+            # Vaccination clocks, as the array engines keep them
+            self.__vaccination_hazard = 0.
+            self.__thresholds = vaccination_thresholds(self.random.uniform(0, 'vaccination', 0, self.population), 0.)
+
+            # The frontier holds the nodes that can change state through their neighbourhood (infected, recovered and
+            # susceptibles with infected neighbours); susceptibles without infected neighbours can only be vaccinated,
+            # when their clock runs out, so their thresholds are visited in order: the initial ones sorted once, the
+            # ones of nodes that become susceptible again in a heap
+            if self.engine_type == 'frontier':
+                self.__frontier = set()
+                self.__quiet_susceptibles = IndexedSet(self.people)
+                self.__vaccination_order = np.argsort(self.__thresholds, kind='stable')
+                self.__sorted_thresholds = self.__thresholds[self.__vaccination_order]
+                self.__vaccination_position = 0
+                self.__vaccination_heap = list()
+        elif self.engine_type == 'vectorized':
+            self.engine = VectorizedEngine(self)
+        elif self.engine_type == 'event':
+            self.engine = EventEngine(self)
+        elif self.engine_type == 'partitioned':
+            # A static network split across worker processes, all the available cores by default
+            self.engine = PartitionedEngine(self, workers)
+        else:
+            print("Unsupported engine type")
+            exit()
 
-    def __create_graph(self, N: int, graph_params: dict):
 
-        if self.graph_type == 'erdos_renyi':
-            p = graph_params.get('p', 0.1)
-            self.graph = nx.erdos_renyi_graph(N, p)
-        elif self.graph_type == 'barabasi_albert':
-            m = graph_params.get('m', 3)
-            self.graph = nx.barabasi_albert_graph(N, m)
-        elif self.graph_type == 'watts_strogatz':
-            k = graph_params.get('k', 4)
-            p = graph_params.get('p', 0.1)
-            self.graph = nx.connected_watts_strogatz_graph(N, k, p)
-        elif self.graph_type == 'stochastic_block_model':
-            sizes = graph_params.get('sizes', [N/4, N/4, N/4, N/4])
-            p_matrix = graph_params.get('p_matrix', [[0.5, 0.25, 0.25, 0.25], [[0.25, 0.5, 0.25, 0.25],[0.25, 0.25, 0.5, 0.25], [0.2, 0.25, 0.25, 0.5]]])
+    def __create_graph(self, N: int, graph_params: dict, graph_cache: str, cacheable: bool):
 
-            if np.sum(sizes) != N:
-                print('Parameter error for stochastic block model - sizes do not much population')
+        # A network in shared memory or in the cache is read in place; a dynamic one is copied, since its edges change
+        # during the run. Only reproducible networks are cached: an unseeded graph would never be requested again
+        if self.__shared_graph is not None:
+            if self.__shared_graph.N != N:
+                print("Error: shared graph and model have a different number of nodes")
                 exit()
-            
-            for row in p_matrix:
-                for elem in row:
-                    if elem < 0 or elem > 1:
-                        print('Parameter error for stochastic block model - probabilities must be between 0 and 1')
-                        exit()
-
-            self.graph = nx.stochastic_block_model(sizes, p_matrix)
+            sources, targets = self.__shared_graph.edges()
+            if self.is_dynamic:
+                sources, targets = np.array(sources), np.array(targets)
+        elif graph_cache is not None and cacheable:
+            sources, targets = GraphCache(graph_cache).get_edges(self.graph_type, graph_params, N, self.graph_seed)
+            if self.is_dynamic:
+                sources, targets = np.array(sources), np.array(targets)
         else:
-            print("Unsupported graph type")
-            exit()
+            sources, targets = generate_edges(self.graph_type, N, graph_params, self.graph_seed)
+        self.edges = EdgeStore(sources, targets)
+
+        # The node-by-node engines walk neighbour lists: a dynamic network keeps them in networkx, where edges are
+        # added and removed, a static one reads them from the CSR adjacency, the shared one when there is one
+        if self.engine_type not in ('agent', 'frontier', 'event'):
+            self.graph = None
+        elif self.is_dynamic:
+            self.graph = nx.Graph()
+            self.graph.add_nodes_from(range(N))
+            self.graph.add_edges_from(zip(self.edges.sources.tolist(), self.edges.targets.tolist()))
+        elif self.__shared_graph is not None:
+            self.graph = AdjacencyLists(self.__shared_graph.adjacency())
+        else:
+            self.graph = AdjacencyLists(csr_adjacency(self.edges.sources, self.edges.targets, N))
 
 
+    # Returns (infection_rate, vaccination_rate, fatality_rate, recovery_rate, breakthrough_rate) at the given time,
+    # or None when no parameters are available for it
     @abstractmethod
-    def _evolve_node(self, n):
+    def _get_rates(self, time):
         pass
 
 
-    def _record_state(self):
-        self.observables[State.SUSCEPTIBLE].append(
-            sum(1 for person in self.people.values()
-                if person.state == State.SUSCEPTIBLE)
-        )
-        self.observables[State.INFECTED].append(
-            sum(1 for person in self.people.values()
-                if person.state == State.INFECTED)
-        )
-        self.observables[State.RECOVERED].append(
-            sum(1 for person in self.people.values()
-                if person.state == State.RECOVERED)
-        )
-        self.observables[State.VACCINATED].append(
-            sum(1 for person in self.people.values()
-                if person.state == State.VACCINATED)
-        )
-        self.observables[State.DEAD].append(
-            sum(1 for person in self.people.values()
-                if person.state == State.DEAD)
-        )
-        self.observables['Time'].append(self.time)
+    def active_edges(self):
+
+        sources, targets = self.edges.active_arrays()
+        if not self.__event_layers:
+            return sources, targets
+
+        layers = [layer.active_arrays() for layer in self.__event_layers.values()]
+        return (np.concatenate([sources] + [layer[0] for layer in layers]),
+                np.concatenate([targets] + [layer[1] for layer in layers]))
+
+
+    # CSR adjacency of the active network; a static network in shared memory uses the shared matrix as it is
+    def adjacency(self, dtype=np.float64):
+
+        if self.__shared_graph is not None and not self.is_dynamic and self.__shared_graph.adjacency().dtype == dtype:
+            return self.__shared_graph.adjacency()
+
+        sources, targets = self.active_edges()
+        return csr_adjacency(sources, targets, self.population, dtype)
+
+
+    def degrees(self):
+
+        sources, targets = self.active_edges()
+        return np.bincount(np.concatenate((sources, targets)), minlength=self.population)
+
+
+    # Number of the current step, which keys the random numbers drawn in it
+    def _step_number(self):
+        return int(round(self.time / self.delta_t))
+
+
+    @property
+    def counts(self):
+
+        # After extinction the totals are the fast-forwarded ones, while the states of the nodes stay as they were
+        if self.__extinct_counts is not None:
+            counts = {state: int(round(count)) for state, count in self.__extinct_counts.items()}
+            counts[State.VACCINATED] = self.population - sum(counts[state] for state in State if state != State.VACCINATED)
+            return counts
+
+        if self.engine is not None:
+            return self.engine.count_states()
+        return dict(self.__counts)
 
 
     def _evolve(self, lockdowns = None, events = None):
 
-        for n in range(self.graph.number_of_nodes()):
-            self._evolve_node(n)
+        rates = self._get_rates(self.time)
+
+        if self.__extinct_counts is None and self.extinction != 'simulate' and self._last_recorded(State.INFECTED) == 0:
+            self.__extinct_counts = self.counts
+
+        if self.__extinct_counts is not None:
+            if rates is not None:
+                self.__fast_forward(rates[1], rates[4])
+            if self.is_dynamic:
+                self.__evolve_dynamic(lockdowns, events)
+            return
+
+        if self.engine is not None:
+            if rates is not None:
+                self.daily_new_inftected[self.row] += self.engine.step(*rates)
+
+            if self.is_dynamic:
+                self.__evolve_dynamic(lockdowns, events)
+            return
+
+        if rates is not None:
+            step = self._step_number()
+            vaccination_prob = rates[1] * self.delta_t
+            self.__vaccination_hazard += vaccination_hazard(vaccination_prob)
+
+            # Only the frontier draws its numbers, straight from their counters
+            if self.__frontier is not None:
+                nodes = list(self.__frontier)
+                for n, random_number in zip(nodes, self.random.at(step, 'transition', nodes).tolist()):
+                    self._evolve_node_state(n, random_number, *rates)
+                self.__vaccinate_quiet_susceptibles(vaccination_prob)
+            else:
+                random_numbers = self.random.uniform(step, 'transition', 0, self.population).tolist()
+                for n, random_number in enumerate(random_numbers):
+                    self._evolve_node_state(n, random_number, *rates)
+
+            waned = [node for node in self.__changed_nodes if self.people[node].state == State.RECOVERED]
 
-        for person in self.people.values():
-            person.state = person.next_state
+        for node in self.__changed_nodes:
+            self.__set_state(node, self.people[node].next_state)
+        self.__changed_nodes.clear()
+
+        if rates is not None and waned:
+            self.__restart_vaccination_clocks(step, waned)
 
         if self.is_dynamic:
             self.__evolve_dynamic(lockdowns, events)
 
 
+    def __fast_forward(self, vaccination_rate, breakthrough_rate):
+
+        # Without infected every susceptible is vaccinated and every recovered loses immunity independently, so a
+        # step only moves compartment totals. The discrete engines apply one transition per node and step; the event
+        # engine runs in continuous time, where a recovered can become susceptible and then be vaccinated in the
+        # same step
+        if self.engine_type == 'event':
+            stay_susceptible = math.exp(-vaccination_rate * self.delta_t)
+            stay_recovered = math.exp(-breakthrough_rate * self.delta_t)
+            if vaccination_rate != breakthrough_rate:
+                recovered_to_susceptible = breakthrough_rate * (stay_recovered - stay_susceptible) / (vaccination_rate - breakthrough_rate)
+            else:
+                recovered_to_susceptible = breakthrough_rate * self.delta_t * stay_recovered
+        else:
+            stay_susceptible = 1. - min(max(vaccination_rate * self.delta_t, 0.), 1.)
+            stay_recovered = 1. - min(max(breakthrough_rate * self.delta_t, 0.), 1.)
+            recovered_to_susceptible = 1. - stay_recovered
+        recovered_to_vaccinated = max(1. - stay_recovered - recovered_to_susceptible, 0.)
+
+        counts = self.__extinct_counts
+        susceptible = counts[State.SUSCEPTIBLE]
+        recovered = counts[State.RECOVERED]
+
+        if self.extinction == 'expected':
+            counts[State.SUSCEPTIBLE] = susceptible * stay_susceptible + recovered * recovered_to_susceptible
+            counts[State.RECOVERED] = recovered * stay_recovered
+        else:
+            rng = self.random.stream(self._step_number(), 'extinction')
+            vaccinated = int(rng.binomial(susceptible, 1. - stay_susceptible))
+            waned, revaccinated, _ = rng.multinomial(recovered, [recovered_to_susceptible, recovered_to_vaccinated,
+                                                                 stay_recovered])
+            counts[State.SUSCEPTIBLE] = susceptible - vaccinated + int(waned)
+            counts[State.RECOVERED] = recovered - int(waned) - int(revaccinated)
+
+
     def _initialize_infection(self, number_of_infectious, target_higher, target_lower):
         
-        initial_nodes = list()
-        if target_higher:
-            nodes_degree = list(dict(self.graph.degree()).values())
-            while len(initial_nodes) < number_of_infectious:
-                target_node = np.argmax(nodes_degree)
-                initial_nodes.append(target_node)
-                nodes_degree[target_node] = -1
-        elif target_lower:
-            nodes_degree = list(dict(self.graph.degree()).values())
-            while len(initial_nodes) < number_of_infectious:
-                target_node = np.argmin(nodes_degree)
-                initial_nodes.append(target_node)
-                nodes_degree[target_node] = self.population
+        if target_higher or target_lower:
+            # A stable sort picks ties in node order, as repeated argmax/argmin calls would
+            nodes_degree = self.degrees()
+            order = np.argsort(-nodes_degree if target_higher else nodes_degree, kind='stable')
+            initial_nodes = order[:number_of_infectious].tolist()
         else:
-            initial_nodes = random.sample(list(self.graph.nodes), number_of_infectious)
+            # The nodes with the smallest numbers of the initial step, which every engine finds alike
+            numbers = self.random.uniform(0, 'initial_infection', 0, self.population)
+            initial_nodes = np.argsort(numbers, kind='stable')[:number_of_infectious].tolist()
+
+        if self.engine is not None:
+            self.engine.infect(initial_nodes)
+            return
 
         for node in initial_nodes:
-            self.people[node].state = State.INFECTED
+            self.__set_state(node, State.INFECTED)
 
 
-    def __evolve_network_structure(self, add_prob=0.01, remove_prob=0.01):
+    def __set_state(self, node, state):
 
-        nodes = list(self.graph.nodes())
+        person = self.people[node]
+        if person.state == state:
+            return
 
-        edges_to_add = int(self.graph.number_of_edges() * add_prob)
-        edges_to_remove = int(self.graph.number_of_edges() * remove_prob)
+        # Infected-neighbour counters change only when a node enters or leaves the infected state
+        if person.state == State.INFECTED:
+            for neighbor in self.graph.neighbors(node):
+                self.__change_infected_neighbors(neighbor, -1)
+        elif state == State.INFECTED:
+            for neighbor in self.graph.neighbors(node):
+                self.__change_infected_neighbors(neighbor, 1)
 
-        new_edges = []
-        new_edges_count = 0
-        while new_edges_count < edges_to_add:
-            u, v = random.sample(nodes, 2)
-            if u != v and not self.graph.has_edge(u, v) and (u,v) not in new_edges:
-                new_edges.append((u,v))
-                new_edges.append((v,u))
-                new_edges_count += 1
-
-        removable_edges = []
-        removable_edges_count = 0
-        edges = list(self.graph.edges())
-        random.shuffle(edges)
-        while removable_edges_count < edges_to_remove:
-            u, v = edges.pop()
-            if (u, v) not in removable_edges:
-                removable_edges.append((u,v))
-                removable_edges.append((v,u))
-                removable_edges_count += 1
-        
-        self.graph.add_edges_from(new_edges)
-        self.graph.remove_edges_from(removable_edges)
+        self.__counts[person.state] -= 1
+        self.__counts[state] += 1
+
+        person.state = state
+        person.next_state = state
+
+        if self.__frontier is not None:
+            self.__update_frontier(node)
+
+
+    def __change_infected_neighbors(self, node, change):
+
+        self.infected_neighbors[node] += change
+        if self.__frontier is not None:
+            self.__update_frontier(node)
+
+
+    def __update_frontier(self, node):
+
+        state = self.people[node].state
+        if state == State.INFECTED or state == State.RECOVERED or \
+           (state == State.SUSCEPTIBLE and self.infected_neighbors[node] > 0):
+            self.__frontier.add(node)
+            self.__quiet_susceptibles.discard(node)
+        elif state == State.SUSCEPTIBLE:
+            self.__frontier.discard(node)
+            self.__quiet_susceptibles.add(node)
+        else:
+            self.__frontier.discard(node)
+            self.__quiet_susceptibles.discard(node)
 
 
-    def __apply_lockdown(self, reduction_factor=0.9):
+    def __vaccinate_quiet_susceptibles(self, vaccination_prob):
+
+        # Only the clocks that ran out in the step are visited, so the cost follows the vaccinations; the entries of
+        # nodes that left the quiet susceptibles, or got a new clock since, are dropped on the way
+        if vaccination_prob >= 1:
+            candidates = list(self.__quiet_susceptibles)
+        else:
+            hazard = self.__vaccination_hazard
+            end = int(np.searchsorted(self.__sorted_thresholds, hazard, side='left'))
+            candidates = self.__vaccination_order[self.__vaccination_position:end].tolist()
+            self.__vaccination_position = end
+            while self.__vaccination_heap and self.__vaccination_heap[0][0] < hazard:
+                candidates.append(heapq.heappop(self.__vaccination_heap)[1])
+            candidates = [node for node in candidates
+                          if node in self.__quiet_susceptibles and self.__thresholds[node] < hazard]
+
+        for node in candidates:
+            if self.people[node].next_state != State.VACCINATED:
+                self.people[node].next_state = State.VACCINATED
+                self.__changed_nodes.append(node)
+
+
+    def __restart_vaccination_clocks(self, step, nodes):
+
+        thresholds = vaccination_thresholds(self.random.at(step, 'vaccination', nodes), self.__vaccination_hazard)
+        self.__thresholds[nodes] = thresholds
+        if self.__frontier is not None:
+            for node, threshold in zip(nodes, thresholds.tolist()):
+                heapq.heappush(self.__vaccination_heap, (threshold, node))
 
-        num_edges_to_remove = int(self.graph.number_of_edges() * reduction_factor)
 
-        removable_edges = []
-        removable_edges_count = 0
-        edges = list(self.graph.edges())
-        random.shuffle(edges)
-        while removable_edges_count < num_edges_to_remove:
-            u, v = edges.pop()
-            if (u, v) not in removable_edges:
-                removable_edges.append((u,v))
-                removable_edges.append((v,u))
-                removable_edges_count += 1
+    def __activate_edges(self, sources, targets):
 
-        self.graph.remove_edges_from(removable_edges)
+        if len(sources) == 0:
+            return
 
-        self.lockdown_edges = removable_edges
+        if self.graph is not None:
+            self.graph.add_edges_from(zip(sources.tolist(), targets.tolist()))
 
+        if self.engine is not None:
+            self.engine.edges_added(sources, targets)
+        else:
+            self.__shift_infected_neighbors(sources, targets, 1)
+
+
+    def __deactivate_edges(self, sources, targets):
 
-    def __end_lockdown(self):
+        if len(sources) == 0:
+            return
+
+        if self.graph is not None:
+            self.graph.remove_edges_from(zip(sources.tolist(), targets.tolist()))
+
+        if self.engine is not None:
+            self.engine.edges_removed(sources, targets)
+        else:
+            self.__shift_infected_neighbors(sources, targets, -1)
 
-        self.graph.add_edges_from(self.lockdown_edges)
-        self.lockdown_edges.clear()
 
+    def __shift_infected_neighbors(self, sources, targets, change):
 
-    def __apply_event(self, aggregation_rate=0.5):
+        for u, v in zip(sources.tolist(), targets.tolist()):
+            if self.people[u].state == State.INFECTED:
+                self.__change_infected_neighbors(v, change)
+            if self.people[v].state == State.INFECTED:
+                self.__change_infected_neighbors(u, change)
 
-        nodes = list(self.graph.nodes())
-        edges_to_add = int(self.graph.number_of_edges() * aggregation_rate)
 
+    def __add_edges(self, edges):
+
+        added = np.array([edge for edge in edges if self.edges.add(*edge)], dtype=np.int64).reshape(-1, 2)
+        self.__activate_edges(added[:, 0], added[:, 1])
+
+
+    def __remove_edges(self, edges):
+
+        removed = np.array([edge for edge in edges if self.edges.remove(*edge)], dtype=np.int64).reshape(-1, 2)
+        self.__deactivate_edges(removed[:, 0], removed[:, 1])
+
+
+    def __in_event_layers(self, u, v):
+        return any(layer.contains(u, v, self.population) for layer in self.__event_layers.values())
+
+
+    def __sample_new_edges(self, count):
+
+        # Node pairs are drawn in batches and tested in order, so the accepted edges are the same as one at a time
+        rng = self.random.stream(self._step_number(), 'new_edges')
         new_edges = []
-        new_edges_count = 0
-        while new_edges_count < edges_to_add:
-            u, v = random.sample(nodes, 2)
-            if u != v and not self.graph.has_edge(u, v) and (u,v) not in new_edges:
-                new_edges.append((u,v))
-                new_edges.append((v,u))
-                new_edges_count += 1
+        sampled = set()
+        while len(new_edges) < count:
+            pairs = rng.integers(self.population, size=(2 * (count - len(new_edges)) + 16, 2)).tolist()
+            for u, v in pairs:
+                edge = EdgeStore.key(u, v)
+                if u != v and edge not in self.edges and edge not in sampled and not self.__in_event_layers(u, v):
+                    sampled.add(edge)
+                    new_edges.append(edge)
+                    if len(new_edges) == count:
+                        break
+
+        return new_edges
+
+
+    def __evolve_network_structure(self, add_prob=0.01, remove_prob=0.01):
+
+        # Only the base network churns; edges disabled by a lockdown are neither counted nor removed
+        edges_to_add = int(self.edges.active_count() * add_prob)
+        edges_to_remove = int(self.edges.active_count() * remove_prob)
+
+        new_edges = self.__sample_new_edges(edges_to_add)
+        removable_edges = self.edges.sample_active(self.random.stream(self._step_number(), 'removed_edges'),
+                                                   edges_to_remove)
+
+        self.__add_edges(new_edges)
+        self.__remove_edges(removable_edges)
+
+
+    def __edge_layers(self):
+        return [self.edges] + list(self.__event_layers.values())
+
+
+    def __apply_lockdown(self, index, reduction_factor=0.9):
+
+        # The lockdown owns one mask bit and disables a random share of all the contacts active at its start, event
+        # overlays included; contacts already disabled by an overlapping lockdown just get its bit as well
+        layers = self.__edge_layers()
+        active_slots = [layer.active_slots() for layer in layers]
+        offsets = np.cumsum([0] + [len(slots) for slots in active_slots])
+
+        num_edges_to_disable = int(offsets[-1] * reduction_factor)
+        rng = self.random.stream(self._step_number(), 'lockdown', index)
+        chosen = np.sort(rng.choice(offsets[-1], num_edges_to_disable, replace=False))
+
+        for layer, slots, low, high in zip(layers, active_slots, offsets[:-1], offsets[1:]):
+            selected = chosen[np.searchsorted(chosen, low):np.searchsorted(chosen, high)] - low
+            disabled = layer.disable(slots[selected], index)
+            self.__deactivate_edges(layer.sources[disabled], layer.targets[disabled])
 
-        self.graph.add_edges_from(new_edges)
-        self.event_edges = new_edges
 
+    def __end_lockdown(self, index):
 
-    def __remove_event(self):
+        for layer in self.__edge_layers():
+            enabled = layer.enable(index)
+            self.__activate_edges(layer.sources[enabled], layer.targets[enabled])
 
-        self.graph.remove_edges_from(self.event_edges)
-        self.event_edges.clear()
+
+    def __apply_event(self, index, aggregation_rate=0.5):
+
+        edges_to_add = int(sum(layer.active_count() for layer in self.__edge_layers()) * aggregation_rate)
+        N = self.population
+
+        # New contacts are drawn in batches; keys already in the network, in another overlay or earlier in the batch
+        # are discarded, keeping the first occurrence so that the accepted edges are a uniform sample
+        rng = self.random.stream(self._step_number(), 'event', index)
+        taken = np.concatenate([layer.keys(N) for layer in self.__edge_layers()])
+        keys = np.empty(0, dtype=np.int64)
+        while len(keys) < edges_to_add:
+            u = rng.integers(N, size=2 * (edges_to_add - len(keys)) + 16)
+            v = rng.integers(N, size=len(u))
+            candidates = np.concatenate((keys, (np.minimum(u, v) * N + np.maximum(u, v))[u != v]))
+            candidates = candidates[~np.isin(candidates, taken)]
+            _, first = np.unique(candidates, return_index=True)
+            keys = candidates[np.sort(first)][:edges_to_add]
+
+        layer = EdgeArray(keys // N, keys % N)
+        self.__event_layers[index] = layer
+        self.__activate_edges(layer.sources, layer.targets)
+
+
+    def __remove_event(self, index):
+
+        layer = self.__event_layers.pop(index, None)
+        if layer is None:
+            return
+        sources, targets = layer.active_arrays()
+        self.__deactivate_edges(sources, targets)
 
 
     def __evolve_dynamic(self, lockdowns, events):
         if lockdowns:
-            for start, end in lockdowns:
+            if len(lockdowns) > 64:
+                print('Error: at most 64 lockdown windows are supported')
+                exit()
+
+            for index, (start, end) in enumerate(lockdowns):
                 if self.time == start:
-                    self.__apply_lockdown()
+                    self.__apply_lockdown(index)
                 elif self.time == end:
-                    self.__end_lockdown()
+                    self.__end_lockdown(index)
 
         if events:
-            for start, end in events:
+            for index, (start, end) in enumerate(events):
                 if self.time == start:
-                    self.__apply_event()
+                    self.__apply_event(index)
                 if self.time == end:
-                    self.__remove_event()
+                    self.__remove_event(index)
 
         self.__evolve_network_structure()
-    
 
-    def _evolve_node_state(self, node_id: int, infection_rate: float, vaccination_rate: float, fatality_rate: float, 
-                      recovery_rate: float, breakthrough_rate: float):
+
+    def _evolve_node_state(self, node_id: int, random_number: float, infection_rate: float, vaccination_rate: float,
+                           fatality_rate: float, recovery_rate: float, breakthrough_rate: float):
         
         current_state = self.people[node_id].state
         next_state = current_state
@@ -227,27 +539,22 @@ class SIRVD_NetworkModel(SIRVD_Base):
             degree = self.graph.degree(node_id)
 
             if degree != 0:
-                infected_neighbors = sum(
-                    1 for neighbor in self.graph.neighbors(node_id)
-                    if self.people[neighbor].state == State.INFECTED
-                )
+                infected_neighbors = self.infected_neighbors[node_id]
                 total_infection_prob = (infection_rate * infected_neighbors / degree) * self.delta_t
             else:
                 total_infection_prob = 0
 
             vaccination_prob = vaccination_rate * self.delta_t
-            
-            random_number = random.random()
 
             if random_number < total_infection_prob:
                 next_state = State.INFECTED
-                self.daily_new_inftected[self.time] += 1
-            elif (random_number - total_infection_prob) < vaccination_prob:
+                self.daily_new_inftected[self.row] += 1
+            elif vaccination_prob >= 1 or self.__thresholds[node_id] < self.__vaccination_hazard or \
+                    (random_number - total_infection_prob) < vaccination_prob * total_infection_prob / (1. - vaccination_prob):
                 next_state = State.VACCINATED
 
         elif current_state == State.INFECTED:            
 
-            random_number = random.random()
             fatality_prob = fatality_rate * self.delta_t
             recovery_prob = recovery_rate * self.delta_t
             
@@ -258,11 +565,12 @@ class SIRVD_NetworkModel(SIRVD_Base):
 
         elif current_state == State.RECOVERED:
             
-            random_number = random.random()
             breakthrough_prob = breakthrough_rate * self.delta_t
 
             if random_number < breakthrough_prob:
                 next_state = State.SUSCEPTIBLE
 
         self.people[node_id].next_state = next_state
+        if next_state != current_state:
+            self.__changed_nodes.append(node_id)
         
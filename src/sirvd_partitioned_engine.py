@@ -0,0 +1,204 @@
+import os
+import weakref
+import multiprocessing
+import numpy as np
+import scipy.sparse as sparse
+from multiprocessing.shared_memory import SharedMemory
+from sirvd_base import STATE_CODES
+from sirvd_rng import CounterRNG
+from sirvd_vectorized_engine import apply_transitions, vaccination_hazard, vaccination_thresholds, SUSCEPTIBLE, INFECTED, RECOVERED, VACCINATED, DEAD
+
+'''This module implements a partitioned engine for the network SIRVD model, which runs a single static network across
+   worker processes. The nodes are split in ranges, at the block boundaries for a stochastic block model and balanced
+   by edges otherwise, and every worker keeps only the adjacency rows of its range, restricted to the nodes they
+   reach. Node states live in two shared memory buffers: at every step each worker reads the infected status of its
+   nodes and of the boundary nodes of the other partitions from one buffer and writes its own range to the other, so
+   the partitions never wait on each other within a step. Each worker draws the counter-based random numbers of its
+   own range, which are the ones the other engines give these nodes, so the trajectories for the same seed do not
+   depend on the number of workers.'''
+def partition_bounds(N: int, adjacency, partitions: int, block_sizes = None):
+
+    # Ranges with about the same number of nodes and edge ends, which are the work of a step; with blocks, the cuts
+    # are the block boundaries closest to the balanced ones, as long as there are enough blocks
+    work = np.concatenate(([0], np.cumsum(np.diff(adjacency.indptr) + 1)))
+    targets = work[-1] * np.arange(1, partitions) / partitions
+
+    if block_sizes is not None and len(block_sizes) >= partitions:
+        block_bounds = np.cumsum(np.asarray(block_sizes, dtype=np.int64))[:-1]
+        cuts = block_bounds[np.argmin(np.abs(work[block_bounds][None, :] - targets[:, None]), axis=1)]
+    else:
+        cuts = np.searchsorted(work, targets)
+
+    return np.unique(np.concatenate(([0], cuts, [N])))
+
+
+def _partition_worker(connection, memory_name: str, N: int, start: int, end: int, indptr, indices, data,
+                      dynamics_seed: int, replicate: int, delta_t):
+
+    memory = SharedMemory(name=memory_name)
+    buffers = np.ndarray((2, N), dtype=np.int8, buffer=memory.buf)
+
+    # Columns are renumbered to the partition's own range followed by the boundary nodes of the others it reaches,
+    # so only the boundary is gathered from the shared states at every step
+    size = end - start
+    inside = (indices >= start) & (indices < end)
+    boundary, boundary_indices = np.unique(indices[~inside], return_inverse=True)
+    local_indices = np.empty(len(indices), dtype=np.int64)
+    local_indices[inside] = indices[inside] - start
+    local_indices[~inside] = size + boundary_indices
+    adjacency = sparse.csr_array((data, local_indices, indptr), shape=(size, size + len(boundary)))
+    degree = np.diff(indptr).astype(np.float64)
+    infected_columns = np.empty(size + len(boundary), dtype=np.float64)
+
+    random = CounterRNG(dynamics_seed, replicate)
+    hazard = 0.
+    thresholds = vaccination_thresholds(random.uniform(0, 'vaccination', start, end), hazard)
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        current, step, rates = message
+
+        previous = buffers[current]
+        states = buffers[1 - current, start:end]
+        states[:] = previous[start:end]
+
+        infected_columns[:size] = states == INFECTED
+        infected_columns[size:] = previous[boundary] == INFECTED
+        infected_neighbors = adjacency @ infected_columns
+        random_numbers = random.uniform(step, 'transition', start, end)
+        hazard += vaccination_hazard(rates[1] * delta_t)
+
+        masks = apply_transitions(states, infected_neighbors, degree, delta_t, random_numbers, thresholds, hazard, *rates)
+        waned = np.flatnonzero(masks[-1])
+        thresholds[waned] = vaccination_thresholds(random.at(step, 'vaccination', start + waned), hazard)
+        connection.send(tuple(int(np.count_nonzero(mask)) for mask in masks))
+
+    del previous, states, buffers
+    memory.close()
+
+
+def _shutdown(owner: int, processes, connections, memory):
+
+    # Forked workers inherit the engines of their parent, whose resources only the parent may release
+    if os.getpid() != owner:
+        return
+
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join()
+
+    # At exit the engine may still hold views on the buffers, which keep the mapping open until the process ends
+    try:
+        memory.close()
+    except BufferError:
+        pass
+    memory.unlink()
+
+
+class PartitionedEngine:
+    def __init__(self, model, workers: int = None):
+
+        if model.is_dynamic:
+            print("Partitioned engine does not support dynamic networks")
+            exit()
+
+        self.model = model
+        N = model.population
+        self.counts = [0] * len(STATE_CODES)
+        self.counts[SUSCEPTIBLE] = N
+
+        self.memory = SharedMemory(create=True, size=2 * N)
+        self.buffers = np.ndarray((2, N), dtype=np.int8, buffer=self.memory.buf)
+        self.buffers[:] = SUSCEPTIBLE
+        self.current = 0
+
+        block_sizes = None
+        if model.graph_type == 'stochastic_block_model':
+            block_sizes = [int(size) for size in model.graph_params.get('sizes', [N/4, N/4, N/4, N/4])]
+
+        adjacency = model.adjacency()
+        self.bounds = partition_bounds(N, adjacency, workers or os.cpu_count() or 1, block_sizes)
+
+        # Every worker gets its rows once, when it starts; the shared buffers are all they exchange afterwards
+        self.connections = list()
+        processes = list()
+        for start, end in zip(self.bounds[:-1], self.bounds[1:]):
+            rows = adjacency[start:end]
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_partition_worker, daemon=True,
+                                              args=(worker_connection, self.memory.name, N, int(start), int(end),
+                                                    rows.indptr, rows.indices, rows.data, model.dynamics_seed,
+                                                    model.replicate, model.delta_t))
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            processes.append(process)
+
+        # Workers are stopped and the shared memory released when the engine is collected or the interpreter exits
+        self.__finalizer = weakref.finalize(self, _shutdown, os.getpid(), processes, self.connections, self.memory)
+
+
+    @property
+    def states(self):
+        return self.buffers[self.current]
+
+
+    def edges_added(self, sources, targets):
+        print("Partitioned engine does not support dynamic networks")
+        exit()
+
+
+    def edges_removed(self, sources, targets):
+        print("Partitioned engine does not support dynamic networks")
+        exit()
+
+
+    def infect(self, nodes):
+
+        nodes = np.unique(np.asarray(nodes, dtype=np.int64))
+        states = self.states
+        for code in range(len(STATE_CODES)):
+            self.counts[code] -= int(np.count_nonzero(states[nodes] == code))
+        states[nodes] = INFECTED
+        self.counts[INFECTED] += len(nodes)
+
+
+    def count_states(self):
+        return {state: self.counts[code] for state, code in STATE_CODES.items()}
+
+
+    def step(self, infection_rate: float, vaccination_rate: float, fatality_rate: float,
+             recovery_rate: float, breakthrough_rate: float):
+
+        rates = (infection_rate, vaccination_rate, fatality_rate, recovery_rate, breakthrough_rate)
+        step = self.model._step_number()
+        for connection in self.connections:
+            connection.send((self.current, step, rates))
+
+        infected_count = vaccinated_count = dead_count = recovered_count = susceptible_count = 0
+        for connection in self.connections:
+            infected, vaccinated, dead, recovered, susceptible = connection.recv()
+            infected_count += infected
+            vaccinated_count += vaccinated
+            dead_count += dead
+            recovered_count += recovered
+            susceptible_count += susceptible
+        self.current = 1 - self.current
+
+        self.counts[SUSCEPTIBLE] += susceptible_count - infected_count - vaccinated_count
+        self.counts[INFECTED] += infected_count - dead_count - recovered_count
+        self.counts[RECOVERED] += recovered_count - susceptible_count
+        self.counts[VACCINATED] += vaccinated_count
+        self.counts[DEAD] += dead_count
+
+        return infected_count
+
+
+    def close(self):
+        self.__finalizer()
@@ -1,6 +1,11 @@
 import matplotlib.pyplot as plt
 import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
 from sirvd_network_model import State
+from sirvd_result_sink import ResultReader
 
 COLOR_SUSCEPTIBLE = 'blue'
 COLOR_INFECTED = 'orange'
@@ -9,60 +14,192 @@ COLOR_VACCINATED = 'purple'
 COLOR_DEAD = 'grey'
 COLOR_REPRODUCTION_RATE = 'black'
 
+STATE_COLORS = {
+    State.SUSCEPTIBLE: COLOR_SUSCEPTIBLE,
+    State.INFECTED: COLOR_INFECTED,
+    State.RECOVERED: COLOR_RECOVERED,
+    State.VACCINATED: COLOR_VACCINATED,
+    State.DEAD: COLOR_DEAD
+}
+
+DEFAULT_MAX_POINTS = 2000
+
+'''This module plots the results of the simulations. Figures are shown on screen, or, with an output directory, rendered
+   headless to image files, one process per result file. Long series are decimated before drawing by keeping the
+   minimum and the maximum of each bucket of points, so peaks survive, and ensemble results are drawn as fan charts of
+   their median and quantile bands, straight from the aggregated summaries stored in the ensemble file.'''
+def decimation_indices(values, max_points: int = DEFAULT_MAX_POINTS):
+
+    # values is one series or a 2D array of series on the same time axis: every bucket keeps the position of the
+    # lowest and of the highest value over all of them, plus the first and the last point
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    length = values.shape[1]
+    if max_points is None or length <= max_points:
+        return np.arange(length)
+
+    buckets = max(1, (max_points - 2) // 2)
+    bucket_size = -(-length // buckets)
+    padded = np.pad(values, ((0, 0), (0, buckets * bucket_size - length)), mode='edge').reshape(len(values), buckets, bucket_size)
+    offsets = np.arange(buckets) * bucket_size
+
+    lowest = np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=2) + offsets
+    highest = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=2) + offsets
+
+    indices = np.concatenate(([0, length - 1], lowest.ravel(), highest.ravel()))
+    return np.unique(np.minimum(indices, length - 1))
+
+
+def _render_file(output_directory: str, max_points: int, image_format: str, filename: str, title: str):
+    return SIRVD_Plotter(output_directory, max_points, image_format).plot_from_file(filename, title)
+
+
 class SIRVD_Plotter:
-    def __init__(self):
-        pass
+    def __init__(self, output_directory: str = None, max_points: int = DEFAULT_MAX_POINTS, image_format: str = 'png'):
+
+        # Without an output directory the figures are shown on screen, otherwise they are only saved
+        self.output_directory = output_directory
+        self.max_points = max_points
+        self.image_format = image_format
+
+        if output_directory is not None:
+            os.makedirs(output_directory, exist_ok=True)
 
-    def plot_from_data(self, data: dict, title: str = 'Simulation Results'):
-        times = data.get('Time', [])
-        if not times:
+
+    def plot_from_data(self, data: dict, title: str = 'Simulation Results', name: str = 'simulation'):
+        times = np.asarray(data.get('Time', []))
+        if len(times) == 0:
             print("Warning: No 'Time' data found for plotting.")
-            return
-
-        plt.figure()
-        state_colors = {
-            State.SUSCEPTIBLE: COLOR_SUSCEPTIBLE,
-            State.INFECTED: COLOR_INFECTED,
-            State.RECOVERED: COLOR_RECOVERED,
-            State.VACCINATED: COLOR_VACCINATED,
-            State.DEAD: COLOR_DEAD
-        }
-
-        for state_name, color in state_colors.items():
-            values = data.get(state_name.value, [])
-            if values:
-                plt.plot(times, values, label=state_name, color=color)
-
-        plt.xlabel('Time')
-        plt.ylabel('Number of People')
-        plt.title(title + ' - State Evolution')
-        plt.legend()
-        plt.grid(True)
-        plt.show()
-
-        reproduction_rate = data.get('reproduction_rate', [])
-        plt.figure()
-        plt.plot(range(len(reproduction_rate)), reproduction_rate, label='Reproduction Rate', color=COLOR_REPRODUCTION_RATE)
-        plt.xlabel('Time')
-        plt.ylabel('Reproduction Rate')
-        plt.title(title + ' - Reproduction Rate')
-        plt.grid(True)
-        plt.legend()
-        plt.show()
+            return []
+
+        figure, axes = self.__new_figure()
+        for state_name, color in STATE_COLORS.items():
+            values = np.asarray(data.get(state_name.value, []))
+            if len(values) > 0:
+                indices = decimation_indices(values, self.max_points)
+                axes.plot(times[indices], values[indices], label=state_name, color=color)
+
+        self.__decorate(axes, 'Number of People', title + ' - State Evolution')
+        saved = [self.__finish(figure, name + '_states')]
+
+        reproduction_rate = np.asarray(data.get('reproduction_rate', []), dtype=float)
+        indices = decimation_indices(reproduction_rate, self.max_points)
+        figure, axes = self.__new_figure()
+        axes.plot(indices, reproduction_rate[indices], label='Reproduction Rate', color=COLOR_REPRODUCTION_RATE)
+        self.__decorate(axes, 'Reproduction Rate', title + ' - Reproduction Rate')
+        saved.append(self.__finish(figure, name + '_reproduction_rate'))
+
+        return [filename for filename in saved if filename is not None]
+
+
+    # Fan chart of an ensemble: the median of every state with the bands between symmetric pairs of quantiles
+    def plot_ensemble_from_data(self, results: dict, title: str = 'Ensemble Results', name: str = 'ensemble'):
+        observables = results.get('observables', {})
+        times = np.asarray(observables.get('Time', []))
+        if len(times) == 0:
+            print("Warning: No 'Time' data found for plotting.")
+            return []
+
+        figure, axes = self.__new_figure()
+        for state_name, color in STATE_COLORS.items():
+            if state_name.value in observables:
+                self.__draw_fan(axes, times, observables[state_name.value], state_name, color)
+
+        self.__decorate(axes, 'Number of People', title + ' - State Evolution')
+        saved = [self.__finish(figure, name + '_states')]
+
+        reproduction_rate = results.get('additional_data', {}).get('reproduction_rate')
+        if reproduction_rate is not None:
+            figure, axes = self.__new_figure()
+            self.__draw_fan(axes, np.arange(len(reproduction_rate['mean'])), reproduction_rate, 'Reproduction Rate',
+                            COLOR_REPRODUCTION_RATE)
+            self.__decorate(axes, 'Reproduction Rate', title + ' - Reproduction Rate')
+            saved.append(self.__finish(figure, name + '_reproduction_rate'))
+
+        return [filename for filename in saved if filename is not None]
 
 
     def plot_from_file(self, filename="simulation_results.json", title='Simulation Results'):
+        name = os.path.splitext(os.path.basename(filename))[0]
         try:
-            with open(filename, 'r') as f:
-                results = json.load(f)
-                observables = results.get('observables', {})
-                additional_data = results.get('additional_data', {})
+            if filename.endswith('.json'):
+                with open(filename, 'r') as f:
+                    results = json.load(f)
+
+                if 'ensemble' in results:
+                    return self.plot_ensemble_from_data(results, title, name)
+
+                plot_data = results.get('observables', {}).copy()
+                plot_data.update(results.get('additional_data', {}))
+            else:
+                # The columns are used as they are mapped from the file, without building lists
+                reader = ResultReader(filename)
+                plot_data = dict(reader.columns)
+                if reader.trailer is not None:
+                    plot_data.update(reader.trailer.get('additional_data', {}))
 
-                plot_data = observables.copy()
-                plot_data.update(additional_data)
-                self.plot_from_data(plot_data, title)
+            return self.plot_from_data(plot_data, title, name)
 
         except FileNotFoundError:
             print(f"Error: File not found at {filename}")
         except json.JSONDecodeError:
-            print(f"Error: Could not decode JSON from {filename}")
\ No newline at end of file
+            print(f"Error: Could not decode JSON from {filename}")
+        return []
+
+
+    # Renders many result files at once on a process pool; only available when saving to an output directory
+    def plot_files(self, filenames: list, titles: list = None, workers: int = None):
+
+        if self.output_directory is None:
+            print("Error: plotting several files at once needs an output directory")
+            exit()
+
+        titles = titles if titles is not None else [os.path.splitext(os.path.basename(filename))[0] for filename in filenames]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_render_file, self.output_directory, self.max_points, self.image_format, filename, title)
+                       for filename, title in zip(filenames, titles)]
+            return [future.result() for future in futures]
+
+
+    def __draw_fan(self, axes, times, summary: dict, label, color):
+
+        quantiles = summary.get('quantiles', {})
+        levels = sorted(quantiles, key=float)
+        central = np.asarray(quantiles['0.5'] if '0.5' in quantiles else summary['mean'], dtype=float)
+
+        bands = [(np.asarray(quantiles[levels[i]], dtype=float), np.asarray(quantiles[levels[-1 - i]], dtype=float))
+                 for i in range(len(levels) // 2) if float(levels[i]) < 0.5 < float(levels[-1 - i])]
+
+        indices = decimation_indices([central] + [bound for band in bands for bound in band], self.max_points)
+        for i, (lower, upper) in enumerate(bands):
+            axes.fill_between(times[indices], lower[indices], upper[indices], color=color, alpha=0.15 + 0.15 * i, linewidth=0)
+        axes.plot(times[indices], central[indices], label=label, color=color)
+
+
+    def __new_figure(self):
+
+        # Headless figures are not registered with pyplot, so no window or GUI backend is involved
+        if self.output_directory is None:
+            figure = plt.figure()
+        else:
+            figure = Figure()
+        return figure, figure.add_subplot()
+
+
+    def __decorate(self, axes, ylabel: str, title: str):
+
+        axes.set_xlabel('Time')
+        axes.set_ylabel(ylabel)
+        axes.set_title(title)
+        axes.legend()
+        axes.grid(True)
+
+
+    def __finish(self, figure, name: str):
+
+        if self.output_directory is None:
+            plt.show()
+            return None
+
+        filename = os.path.join(self.output_directory, f"{name}.{self.image_format}")
+        figure.savefig(filename)
+        return filename
@@ -0,0 +1,125 @@
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b'SIRVDCOL'
+FORMAT_VERSION = 1
+END_OF_DATA = 0xFFFFFFFF
+DEFAULT_CHUNK_SIZE = 256
+
+'''This module implements a streaming, columnar result file for SIRVD simulations. Per-step values are appended to the
+   file one chunk at a time, each chunk holding a block per column, so a run only keeps the chunk it is filling in
+   memory. A chunk is written and flushed in one piece, which lets a reader load every
+   complete chunk while the run is still going; the summary data and the parameters are appended as a JSON trailer
+   once the run ends.
+
+   Layout: MAGIC, uint32 header length, JSON header (column names and dtypes), then chunks made of a uint32 row count
+   followed by the rows of each column, and finally END_OF_DATA, uint32 trailer length and the JSON trailer.'''
+class ResultWriter:
+    def __init__(self, filename: str, columns: dict):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+
+        # Column names and NumPy types, stored little-endian
+        self.dtypes = {name: np.dtype(dtype).newbyteorder('<') for name, dtype in columns.items()}
+
+        header = json.dumps({'version': FORMAT_VERSION,
+                             'columns': [[name, dtype.str] for name, dtype in self.dtypes.items()]}).encode()
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+
+    # Appends one chunk, from a dictionary of equally long arrays with one entry per column
+    def write(self, columns: dict):
+
+        rows = len(next(iter(columns.values())))
+        if rows == 0:
+            return
+
+        chunk = [struct.pack('<I', rows)] + [np.ascontiguousarray(columns[name], dtype=dtype).tobytes()
+                                             for name, dtype in self.dtypes.items()]
+        self.file.write(b''.join(chunk))
+        self.file.flush()
+
+
+    def close(self, trailer: dict = None):
+
+        if trailer is not None:
+            encoded = json.dumps(trailer, default=_to_builtin).encode()
+            self.file.write(struct.pack('<II', END_OF_DATA, len(encoded)) + encoded)
+        self.file.close()
+
+
+class ResultReader:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.columns = dict()
+        self.trailer = None
+        self.complete = False
+        self.__read()
+
+
+    def __read(self):
+
+        size = os.path.getsize(self.filename)
+        if size < len(MAGIC) + 4:
+            return
+
+        data = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            print(f"Error: {self.filename} is not a SIRVD result file")
+            exit()
+
+        offset = len(MAGIC)
+        header_length = struct.unpack_from('<I', data, offset)[0]
+        header = json.loads(bytes(data[offset + 4:offset + 4 + header_length]))
+        columns = [(name, np.dtype(dtype)) for name, dtype in header['columns']]
+        row_size = sum(dtype.itemsize for _, dtype in columns)
+        offset += 4 + header_length
+
+        # Every column of a chunk is a view on the mapped file; only complete chunks are taken, since the last one may
+        # still be in the middle of being written
+        blocks = {name: [] for name, _ in columns}
+        while offset + 4 <= size:
+            rows = struct.unpack_from('<I', data, offset)[0]
+            if rows == END_OF_DATA:
+                if offset + 8 <= size:
+                    trailer_length = struct.unpack_from('<I', data, offset + 4)[0]
+                    if offset + 8 + trailer_length <= size:
+                        self.trailer = json.loads(bytes(data[offset + 8:offset + 8 + trailer_length]))
+                        self.complete = True
+                break
+
+            if offset + 4 + rows * row_size > size:
+                break
+            offset += 4
+            for name, dtype in columns:
+                blocks[name].append(data[offset:offset + rows * dtype.itemsize].view(dtype))
+                offset += rows * dtype.itemsize
+
+        for name, dtype in columns:
+            self.columns[name] = np.concatenate(blocks[name]) if blocks[name] else np.zeros(0, dtype=dtype)
+
+
+    # The same structure as the JSON results of the models, for plotting and export
+    def to_dict(self):
+
+        observables = {name: values.tolist() for name, values in self.columns.items() if name != 'new_infected'}
+        trailer = self.trailer if self.trailer is not None else dict()
+
+        additional_data = dict(trailer.get('additional_data', dict()))
+        if 'new_infected' in self.columns:
+            additional_data['new_infected'] = self.columns['new_infected'].tolist()
+
+        return {'observables': observables, 'additional_data': additional_data,
+                'parameters': trailer.get('parameters', dict())}
+
+
+def export_json(filename: str, json_filename: str):
+
+    with open(json_filename, 'w') as f:
+        json.dump(ResultReader(filename).to_dict(), f)
+
+
+def _to_builtin(value):
+    return value.item() if isinstance(value, np.generic) else value.tolist()
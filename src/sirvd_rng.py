@@ -0,0 +1,114 @@
+import math
+import numpy as np
+
+PURPOSES = ('initial_infection', 'transition', 'new_edges', 'removed_edges', 'lockdown', 'event', 'extinction',
+            'event_engine', 'vaccination')
+STREAM_BUFFER_SIZE = 4096
+
+# Philox4x64-10 constants, as in NumPy's Philox
+PHILOX_MULTIPLIERS = (np.uint64(0xD2E7470EE14C6C93), np.uint64(0xCA5A826395121157))
+PHILOX_WEYL = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xBB67AE8584CAA73B))
+PHILOX_ROUNDS = 10
+LOW_BITS = np.uint64(0xFFFFFFFF)
+HALF_WIDTH = np.uint64(32)
+# Beyond this share of the span of the nodes, the whole span is drawn in bulk and indexed
+SCATTERED_SHARE = 1 / 32
+
+'''This module implements the counter-based random numbers of the network SIRVD model. A Philox generator is keyed
+   by the seed and the replicate, and its counter holds the step, the purpose of the draws and the position of the
+   numbers, so that every number is a function of (seed, replicate, step, node, purpose) alone: the number of a node
+   at a step does not depend on which nodes were drawn before it, on the order they are visited, or on how they are
+   split between processes. The engines draw the numbers of all their nodes, or of a range of them, in bulk, and
+   the helpers that need a sequence of draws for a step get a stream of their own. The numbers of a few scattered
+   nodes are computed directly from their counters, with the Philox rounds vectorised over the nodes.'''
+def _multiply(a, b):
+
+    # High and low words of the 128-bit products of 64-bit words, from their 32-bit halves
+    a_low, a_high = a & LOW_BITS, a >> HALF_WIDTH
+    b_low, b_high = b & LOW_BITS, b >> HALF_WIDTH
+    low_low, low_high, high_low = a_low * b_low, a_low * b_high, a_high * b_low
+    middle = (low_low >> HALF_WIDTH) + (low_high & LOW_BITS) + (high_low & LOW_BITS)
+    return a_high * b_high + (low_high >> HALF_WIDTH) + (high_low >> HALF_WIDTH) + (middle >> HALF_WIDTH), a * b
+
+
+def _philox(counter, key):
+
+    c0, c1, c2, c3 = counter
+    k0, k1 = key
+    with np.errstate(over='ignore'):
+        for round in range(PHILOX_ROUNDS):
+            if round > 0:
+                k0, k1 = k0 + PHILOX_WEYL[0], k1 + PHILOX_WEYL[1]
+            high0, low0 = _multiply(c0, PHILOX_MULTIPLIERS[0])
+            high1, low1 = _multiply(c2, PHILOX_MULTIPLIERS[1])
+            c0, c1, c2, c3 = high1 ^ c1 ^ k0, low1, high0 ^ c3 ^ k1, low0
+    return np.stack((c0, c1, c2, c3))
+
+
+class CounterRNG:
+    def __init__(self, seed: int, replicate: int = 0):
+        self.seed = seed
+        self.replicate = replicate
+        self.key = np.array([seed, replicate], dtype=np.uint64)
+
+
+    def generator(self, step: int, purpose: str, index: int = 0, block: int = 0):
+        return np.random.Generator(np.random.Philox(counter=[block, step, PURPOSES.index(purpose), index], key=self.key))
+
+
+    # Uniform numbers of the nodes from start to end at a step; node i takes lane i % 4 of counter block i // 4, so
+    # any range gives the numbers the whole array would have
+    def uniform(self, step: int, purpose: str, start: int, end: int):
+
+        offset = start % 4
+        numbers = self.generator(step, purpose, block=start // 4).random(end - start + offset)
+        return numbers[offset:]
+
+
+    # Uniform numbers of the given nodes at a step, the same that uniform gives them. NumPy's Philox increments its
+    # counter before every block, so node i is lane i % 4 of the block after i // 4
+    def at(self, step: int, purpose: str, nodes):
+
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(nodes) == 0:
+            return np.zeros(0)
+        span = int(nodes.max()) + 1
+        if len(nodes) > span * SCATTERED_SHARE:
+            return self.uniform(step, purpose, 0, span)[nodes]
+
+        blocks = (nodes // 4 + 1).astype(np.uint64)
+        counter = (blocks, np.full(len(nodes), step, dtype=np.uint64),
+                   np.full(len(nodes), PURPOSES.index(purpose), dtype=np.uint64), np.zeros(len(nodes), dtype=np.uint64))
+        words = _philox(counter, self.key)[nodes % 4, np.arange(len(nodes))]
+        return (words >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+    # Sequential draws for a step, such as the edges sampled by the network dynamics; index separates the streams
+    # of several draws with the same purpose at the same step
+    def stream(self, step: int, purpose: str, index: int = 0):
+        return self.generator(step, purpose, index)
+
+
+class BufferedStream:
+    # Scalar draws from a stream at Python speed, with the methods of random.Random used by the event engine
+    def __init__(self, generator):
+        self.generator = generator
+        self.buffer = list()
+        self.position = 0
+
+
+    def random(self):
+
+        if self.position == len(self.buffer):
+            self.buffer = self.generator.random(STREAM_BUFFER_SIZE).tolist()
+            self.position = 0
+        self.position += 1
+        return self.buffer[self.position - 1]
+
+
+    def randrange(self, stop: int):
+        return int(self.random() * stop)
+
+
+    def expovariate(self, rate: float):
+        return -math.log(1. - self.random()) / rate
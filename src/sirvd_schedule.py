@@ -0,0 +1,54 @@
+import numpy as np
+
+'''This module implements a run-length encoded parameter schedule. A piecewise-constant sequence, such as a constant
+   rate or rates extracted from weekly reported data, is kept as its distinct consecutive values and the length of each
+   run, and is written to the results in the same form instead of one value per step.'''
+class RunLengthSchedule:
+    def __init__(self, values, run_lengths):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.run_lengths = np.asarray(run_lengths, dtype=np.int64)
+        self.ends = np.cumsum(self.run_lengths)
+
+        if len(self.values) != len(self.run_lengths):
+            print("Error: schedule values and run lengths are not of the same length")
+            exit()
+
+
+    @classmethod
+    def constant(cls, value: float, length: int):
+        return cls([value], [length]) if length > 0 else cls([], [])
+
+
+    @classmethod
+    def from_sequence(cls, sequence):
+
+        sequence = np.asarray(sequence, dtype=np.float64)
+        if len(sequence) == 0:
+            return cls([], [])
+
+        starts = np.flatnonzero(np.concatenate(([True], sequence[1:] != sequence[:-1])))
+        return cls(sequence[starts], np.diff(np.append(starts, len(sequence))))
+
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data['values'], data['run_lengths'])
+
+
+    def __len__(self):
+        return int(self.ends[-1]) if len(self.ends) > 0 else 0
+
+
+    def __getitem__(self, time: int):
+
+        if time < 0 or time >= len(self):
+            raise IndexError('schedule index out of range')
+        return self.values[np.searchsorted(self.ends, time, side='right')].item()
+
+
+    def to_list(self):
+        return np.repeat(self.values, self.run_lengths).tolist()
+
+
+    def to_dict(self):
+        return {'values': self.values.tolist(), 'run_lengths': self.run_lengths.tolist()}
@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sparse
+from sirvd_edge_store import csr_adjacency
+
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+
+'''This module places a network in shared memory, so that the processes of a pool all read the same copy of it. The
+   edge list and the CSR adjacency of the engines are written once as .npy files to a memory-backed directory, and
+   every process maps them read-only: the pages are shared by the operating system instead of being copied into each
+   process. A SharedGraph is pickled as the path of its directory, so passing it to a worker sends no graph data.'''
+class SharedGraph:
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(os.path.join(path, 'graph.json'), 'r') as f:
+            self.N = json.load(f)['N']
+
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in ('sources', 'targets', 'indptr', 'indices', 'data')}
+        self.sources = arrays['sources']
+        self.targets = arrays['targets']
+        self.__adjacency = sparse.csr_array((arrays['data'], arrays['indices'], arrays['indptr']), shape=(self.N, self.N))
+
+
+    def __reduce__(self):
+        return (SharedGraph, (self.path,))
+
+
+    @classmethod
+    def create(cls, N: int, sources, targets, directory: str = None):
+
+        # Edges are stored with the lower endpoint first, as the edge store keeps them, so models read them without
+        # a copy; the adjacency is built from them the same way the engines would build it
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+        adjacency = csr_adjacency(sources, targets, N)
+
+        if directory is None:
+            directory = SHARED_MEMORY_DIRECTORY if os.path.isdir(SHARED_MEMORY_DIRECTORY) else tempfile.gettempdir()
+        path = tempfile.mkdtemp(prefix='sirvd_graph_', dir=directory)
+
+        arrays = {'sources': sources, 'targets': targets, 'indptr': adjacency.indptr, 'indices': adjacency.indices,
+                  'data': adjacency.data}
+        for name, values in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), values)
+        with open(os.path.join(path, 'graph.json'), 'w') as f:
+            json.dump({'N': N, 'edges': len(sources)}, f)
+
+        return cls(path)
+
+
+    def edges(self):
+        return self.sources, self.targets
+
+
+    def adjacency(self):
+        return self.__adjacency
+
+
+    # Removes the files; processes that already mapped them keep reading their mapping until they release it
+    def release(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,144 @@
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sirvd_graph_cache import GraphCache
+from sirvd_graph_generators import generate_edges
+from sirvd_result_sink import ResultReader
+from sirvd_shared_graph import SharedGraph
+
+RUN_PARAMETERS = ('initial_infectious', 'simulation_time', 'lockdowns', 'events', 'target_higher', 'target_lower')
+MANIFEST_FILENAME = 'manifest.json'
+
+'''This module runs parameter sweeps of a SIRVD model. The points of a sweep come from a grid, as every combination of
+   the listed values, or from a list of samples, and each of them may change the parameters of the model as well as
+   the ones of the run, such as the lockdown windows. Every distinct network of the sweep is built once and placed in
+   shared memory, where all the workers of the process pool read it, and the points are run across the cores. A
+   manifest in the result directory records every completed point, so an interrupted sweep resumes where it stopped.'''
+def sweep_points(grid: dict = None, samples: list = None):
+
+    points = list()
+    if grid:
+        names = list(grid)
+        points.extend(dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names)))
+    if samples:
+        points.extend(dict(sample) for sample in samples)
+    return points
+
+
+def _point_key(model_name: str, model_params: dict, run_params: dict, seed: int):
+
+    description = json.dumps([model_name, model_params, run_params, seed], sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def _graph_key(model_params: dict):
+    return json.dumps([model_params.get('graph_type'), model_params.get('graph_params'), model_params.get('N')],
+                      sort_keys=True, default=str)
+
+
+def _run_point(model_class, model_params: dict, run_params: dict, seed: int, graph_seed: int, shared_graph,
+               result_filename: str):
+
+    if shared_graph is not None:
+        model = model_class(**model_params, seed=seed, graph_seed=graph_seed, shared_graph=shared_graph)
+    else:
+        model = model_class(**model_params)
+    model.run_simulation(**run_params, result_filename=result_filename, verbose=False)
+
+    return {name: value for name, value in ResultReader(result_filename).trailer['additional_data'].items()
+            if name != 'reproduction_rate'}
+
+
+def _save_manifest(filename: str, manifest: dict):
+
+    # Replaced in one step, so an interruption never leaves a partial manifest
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', suffix='.json')
+    with os.fdopen(descriptor, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(temporary, filename)
+
+
+def run_sweep(model_class, base_params: dict, run_params: dict, grid: dict = None, samples: list = None,
+              result_directory: str = 'sweep_results', seed: int = None, graph_seed: int = None, workers: int = None,
+              graph_cache: str = None):
+
+    os.makedirs(result_directory, exist_ok=True)
+    manifest_filename = os.path.join(result_directory, MANIFEST_FILENAME)
+    manifest = {'model': model_class.__name__, 'points': dict()}
+    if os.path.exists(manifest_filename):
+        with open(manifest_filename, 'r') as f:
+            manifest = json.load(f)
+
+    # Network models share one network per graph description: without a graph seed it is drawn once for the sweep
+    seeds = [seed, graph_seed]
+    network = 'graph_type' in base_params or any('graph_type' in point for point in sweep_points(grid, samples))
+    if network and graph_seed is None:
+        graph_seed = int(np.random.SeedSequence(seed).generate_state(1)[0])
+
+    # A point is keyed by its parameters, and its seed derives from the key, so it does not depend on the order of
+    # the points or on which of them were already run
+    pending = dict()
+    for point in sweep_points(grid, samples):
+        model_params = dict(base_params)
+        point_run_params = dict(run_params)
+        for name, value in point.items():
+            (point_run_params if name in RUN_PARAMETERS else model_params)[name] = value
+
+        key = _point_key(model_class.__name__, model_params, point_run_params, seeds)
+        point_seed = None if seed is None else int.from_bytes(hashlib.sha256(f"{seed}:{key}".encode()).digest()[:8], 'little')
+        result_filename = os.path.join(result_directory, key[:16] + '.sirvd')
+
+        entry = manifest['points'].get(key)
+        if entry is not None and entry['status'] == 'done' and os.path.exists(result_filename):
+            continue
+
+        manifest['points'][key] = {'point': point, 'seed': point_seed, 'result_file': result_filename, 'status': 'pending'}
+        pending.setdefault(_graph_key(model_params) if network else None, []).append(
+            (key, model_params, point_run_params, point_seed, result_filename))
+
+    _save_manifest(manifest_filename, manifest)
+
+    total = sum(len(points) for points in pending.values())
+    completed = 0
+    print(f"Sweep points to run: {total} of {len(manifest['points'])}")
+
+    # Networks are built one at a time, and a pool runs all the points of one before the next is built, so the
+    # shared memory holds a single network and the workers release it when their pool ends
+    for points in pending.values():
+        shared_graph = None
+        if network:
+            model_params = points[0][1]
+            if graph_cache is not None:
+                sources, targets = GraphCache(graph_cache).get_edges(model_params['graph_type'], model_params.get('graph_params'),
+                                                                     model_params['N'], graph_seed)
+            else:
+                sources, targets = generate_edges(model_params['graph_type'], model_params['N'], model_params.get('graph_params'),
+                                                  graph_seed)
+            shared_graph = SharedGraph.create(model_params['N'], sources, targets)
+            del sources, targets
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_run_point, model_class, model_params, point_run_params, point_seed, graph_seed,
+                                           shared_graph, result_filename): key
+                           for key, model_params, point_run_params, point_seed, result_filename in points}
+
+                for future in as_completed(futures):
+                    entry = manifest['points'][futures[future]]
+                    entry['additional_data'] = future.result()
+                    entry['status'] = 'done'
+                    _save_manifest(manifest_filename, manifest)
+
+                    completed += 1
+                    print(f"\rCompleted sweep points: {completed}/{total}", end='')
+        finally:
+            if shared_graph is not None:
+                shared_graph.release()
+
+    print('\nSweep Terminated')
+
+    return manifest
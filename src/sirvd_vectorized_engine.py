@@ -0,0 +1,145 @@
+import math
+import numpy as np
+from sirvd_base import State, STATE_CODES
+
+SUSCEPTIBLE = STATE_CODES[State.SUSCEPTIBLE]
+INFECTED = STATE_CODES[State.INFECTED]
+RECOVERED = STATE_CODES[State.RECOVERED]
+VACCINATED = STATE_CODES[State.VACCINATED]
+DEAD = STATE_CODES[State.DEAD]
+
+'''This module implements an array-backed engine for the network SIRVD model. Node states are kept in a NumPy array and
+   the adjacency in CSR form, so that a whole step is computed with one sparse mat-vec and boolean masks. The masks
+   are built by apply_transitions, which the batched and partitioned engines share, so all of them apply the same
+   rule to the same random numbers.
+
+   Vaccination runs on clocks: a node that becomes susceptible draws an exponential threshold once, and it is
+   vaccinated at the first step where the vaccination hazard accumulated since then exceeds it, which happens with
+   the vaccination probability of the step. Susceptibles with infected neighbours may also be vaccinated by their
+   number of the step, so that among the ones not infected the vaccination probability stays the one a single draw
+   per step gives. Susceptibles without infected neighbours only change when their clock runs out, so the frontier
+   engine needs no number for them.'''
+def vaccination_hazard(vaccination_prob: float):
+
+    # Hazard added to the clocks by a step; a step that vaccinates every susceptible leaves them as they are
+    return -math.log1p(-vaccination_prob) if 0 < vaccination_prob < 1 else 0.
+
+
+def vaccination_thresholds(random_numbers, hazard: float):
+
+    # Accumulated hazard at which the nodes that become susceptible, when it is hazard, are vaccinated
+    return hazard - np.log1p(-random_numbers)
+
+
+def apply_transitions(states, infected_neighbors, degree, delta_t, random_numbers, thresholds, hazard: float,
+                      infection_rate: float, vaccination_rate: float, fatality_rate: float, recovery_rate: float,
+                      breakthrough_rate: float):
+
+    # states, infected_neighbors, degree, random_numbers and the vaccination thresholds broadcast together, one node
+    # per row, and hazard is the one accumulated up to the end of the step; the states are updated in place and the
+    # masks of the nodes that changed are returned
+    susceptible = states == SUSCEPTIBLE
+    infected = states == INFECTED
+    recovered = states == RECOVERED
+
+    total_infection_prob = np.divide(infection_rate * infected_neighbors, degree,
+                                     out=np.zeros(states.shape), where=degree != 0) * delta_t
+    vaccination_prob = vaccination_rate * delta_t
+    fatality_prob = fatality_rate * delta_t
+    recovery_prob = recovery_rate * delta_t
+    breakthrough_prob = breakthrough_rate * delta_t
+
+    new_infected = susceptible & (random_numbers < total_infection_prob)
+    if vaccination_prob >= 1:
+        new_vaccinated = susceptible & ~new_infected
+    else:
+        clock_vaccination_prob = vaccination_prob * total_infection_prob / (1. - vaccination_prob)
+        new_vaccinated = susceptible & ~new_infected & ((thresholds < hazard) |
+                                                        ((random_numbers - total_infection_prob) < clock_vaccination_prob))
+    new_dead = infected & (random_numbers < fatality_prob)
+    new_recovered = infected & ~new_dead & ((random_numbers - fatality_prob) < recovery_prob)
+    new_susceptible = recovered & (random_numbers < breakthrough_prob)
+
+    states[new_infected] = INFECTED
+    states[new_vaccinated] = VACCINATED
+    states[new_dead] = DEAD
+    states[new_recovered] = RECOVERED
+    states[new_susceptible] = SUSCEPTIBLE
+
+    return new_infected, new_vaccinated, new_dead, new_recovered, new_susceptible
+
+
+class VectorizedEngine:
+    def __init__(self, model):
+        self.model = model
+        self.states = np.full(model.population, SUSCEPTIBLE, dtype=np.int8)
+        self.counts = [0] * len(STATE_CODES)
+        self.counts[SUSCEPTIBLE] = model.population
+
+        self.hazard = 0.
+        self.thresholds = vaccination_thresholds(model.random.uniform(0, 'vaccination', 0, model.population), 0.)
+
+        self.__update_adjacency()
+
+
+    def __update_adjacency(self):
+
+        self.adjacency = self.model.adjacency()
+        self.degree = np.diff(self.adjacency.indptr).astype(np.float64)
+        self.adjacency_changed = False
+
+
+    # The CSR matrix is rebuilt lazily, once per step, after any change of the network structure
+    def edges_added(self, sources, targets):
+        self.adjacency_changed = True
+
+
+    def edges_removed(self, sources, targets):
+        self.adjacency_changed = True
+
+
+    def infect(self, nodes):
+
+        nodes = np.unique(np.asarray(nodes, dtype=np.int64))
+        for code in range(len(STATE_CODES)):
+            self.counts[code] -= int(np.count_nonzero(self.states[nodes] == code))
+        self.states[nodes] = INFECTED
+        self.counts[INFECTED] += len(nodes)
+
+
+    def count_states(self):
+        return {state: self.counts[code] for state, code in STATE_CODES.items()}
+
+
+    def step(self, infection_rate: float, vaccination_rate: float, fatality_rate: float,
+             recovery_rate: float, breakthrough_rate: float):
+
+        if self.adjacency_changed:
+            self.__update_adjacency()
+
+        states = self.states
+        step = self.model._step_number()
+        infected_neighbors = self.adjacency @ (states == INFECTED).astype(np.float64)
+        random_numbers = self.model.random.uniform(step, 'transition', 0, len(states))
+        self.hazard += vaccination_hazard(vaccination_rate * self.model.delta_t)
+
+        new_infected, new_vaccinated, new_dead, new_recovered, new_susceptible = apply_transitions(
+            states, infected_neighbors, self.degree, self.model.delta_t, random_numbers, self.thresholds, self.hazard,
+            infection_rate, vaccination_rate, fatality_rate, recovery_rate, breakthrough_rate)
+
+        waned = np.flatnonzero(new_susceptible)
+        self.thresholds[waned] = vaccination_thresholds(self.model.random.at(step, 'vaccination', waned), self.hazard)
+
+        infected_count = int(np.count_nonzero(new_infected))
+        vaccinated_count = int(np.count_nonzero(new_vaccinated))
+        dead_count = int(np.count_nonzero(new_dead))
+        recovered_count = int(np.count_nonzero(new_recovered))
+        susceptible_count = int(np.count_nonzero(new_susceptible))
+
+        self.counts[SUSCEPTIBLE] += susceptible_count - infected_count - vaccinated_count
+        self.counts[INFECTED] += infected_count - dead_count - recovered_count
+        self.counts[RECOVERED] += recovered_count - susceptible_count
+        self.counts[VACCINATED] += vaccinated_count
+        self.counts[DEAD] += dead_count
+
+        return infected_count